@@ -26,7 +26,6 @@ def mk_client(access_credentials):
         
 db_user = 'debirdify'
 db_password = env('DEBIRDIFY_INSTANCE_DB_PASSWORD')
-con = psycopg2.connect(f"dbname=debirdify user={db_user} host=localhost password={db_password}")
 sleep_time = 1
 MAX_SLEEP_TIME = 8
 
@@ -40,20 +39,46 @@ def wait():
     if sleep_time < MAX_SLEEP_TIME: sleep_time *= 2
 
 
-def known_host_callback(s):
+def connect():
+    return psycopg2.connect(f"dbname=debirdify user={db_user} host=localhost password={db_password}")
+
+con = None # the daemon's own connection (see main below)
+
+# The known instance index refreshes itself in a background thread, so it uses its own connections
+def load_known_instances():
+    c = connect()
     try:
-        with connection.cursor() as cur:
-            cur.execute('SELECT name FROM instances WHERE name=%s LIMIT 1', [s])
-            row = cur.fetchone()
-            if row is None:
-                try:
-                    cur.execute('INSERT INTO unknown_hosts (name) VALUES (%s);', [s])
-                except:
-                    pass
-            else:
-                return True
-    except Exception as e:
-        return False
+        with c.cursor() as cur:
+            cur.execute('SELECT name, software IS NOT NULL FROM instances')
+            return cur.fetchall()
+    finally:
+        c.close()
+
+def record_unknown_hosts(hosts):
+    c = connect()
+    try:
+        with c.cursor() as cur:
+            cur.execute('INSERT INTO unknown_hosts (name) SELECT UNNEST(%s) ON CONFLICT DO NOTHING', [hosts])
+        c.commit()
+    finally:
+        c.close()
+
+def load_bad_hosts():
+    c = connect()
+    try:
+        with c.cursor() as cur:
+            cur.execute('SELECT name FROM bad_hosts')
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        c.close()
+
+known_instances = extract_mastodon_ids.KnownInstanceIndex(load_known_instances, record_unknown_hosts, load_bad_hosts)
+
+# built once at startup and reused for every chunk of every job
+extraction_workers = int(os.environ.get('DEBIRDIFY_EXTRACTION_WORKERS', '0'))
+extractor = extract_mastodon_ids.MastodonIdExtractor(
+    known_hosts_callback = known_instances.known_hosts, forbidden_host_callback = known_instances.is_forbidden,
+    workers = extraction_workers, slice_size = 25)
 
 def handle_requests(*, client, by_id, requests):
     if by_id:
@@ -72,7 +97,7 @@ def handle_requests(*, client, by_id, requests):
                 expansions='pinned_tweet_id')
 
     results = extract_mastodon_ids.Results()
-    extract_mastodon_ids.extract_mastodon_ids_from_users(client, lambda x: None, resp, results, known_host_callback=known_host_callback)
+    extract_mastodon_ids.extract_mastodon_ids_from_users(client, lambda x: None, resp, results, extractor=extractor)
     
     if by_id:
         result_map = {str(u.uid): u for u in results.results.values()}
@@ -140,5 +165,11 @@ def run():
                 sleep_time = 1
                 handle_job(row[0], row[1], row[2])
                 con.commit()
-            
-run()
+
+# The fork server of the extractor's pool imports this module again, so nothing may happen on
+# import apart from the definitions above
+if __name__ == '__main__':
+    con = connect()
+    extractor.start_pool()
+    run()
+
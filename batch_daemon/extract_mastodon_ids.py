@@ -1,4 +1,13 @@
+import os
 import re
+import sys
+import multiprocessing
+import time
+import threading
+import traceback
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from itertools import islice
 from functools import partial
 from urllib.parse import urlparse, urlunparse
@@ -14,6 +23,10 @@ max_lists_pages = 5
 # Max pages of list members to query (1 page is roughly 100 members)
 max_list_member_pages = 200
 
+# Number of pages of users that are fetched from Twitter ahead of the page that is currently being
+# processed (0: fetch the next page only once the current one has been processed)
+prefetch_pages = 1
+
 class RequestedUser:
     def __init__(self, src, screenname = None, uid = None, typ = None):
         self.screenname = screenname
@@ -72,7 +85,15 @@ _forbidden_hosts = {
   'tiktok.com', 'youtube.com', 'medium.com', 'skeb.jp', 'pronouns.page', 'foundation.app', 'gamejolt.com', 'traewelling.de', 'observablehq.com', 
   'gmail.com', 'hotmail.com', 'manylink.co', 'withkoji.com', 'twitter.com', 'nomadlist.com', 'figma.com', 'peakd.com', 'jabber.ccc.de',
   'yahoo.com', 'aol.com', 'vice.com', 'wsj.com', 'theguardian.com', 'cbsnews.com', 'cnn.com', 'welt.de', 'nytimes.com', 'gmx.de', 'web.de',
-  'posteo.de', 'arcor.de', 'bell.net'}
+  'posteo.de', 'arcor.de', 'bell.net',
+  # link shorteners and link-in-bio services
+  'bit.ly', 't.co', 'tinyurl.com', 'goo.gl', 'ow.ly', 'buff.ly', 'is.gd', 'rebrand.ly', 'cutt.ly', 'linktr.ee', 'lnk.to',
+  'lnk.bio', 'carrd.co', 'beacons.ai', 'campsite.bio',
+  # mail providers
+  'googlemail.com', 'outlook.com', 'live.com', 'msn.com', 'icloud.com', 'me.com', 'mac.com', 'protonmail.com', 'proton.me', 'pm.me',
+  'tutanota.com', 'tuta.io', 'mailbox.org', 'mail.com', 'gmx.net', 'gmx.at', 'gmx.ch', 't-online.de', 'freenet.de', 'yandex.ru',
+  'mail.ru', 'zoho.com', 'fastmail.com', 'hey.com', 'yahoo.co.jp', 'yahoo.co.uk', 'hotmail.co.uk', 'hotmail.fr', 'orange.fr',
+  'free.fr', 'libero.it', 'qq.com', '163.com'}
 
 # Matches anything of the form @foo@bar.bla or foo@bar.social or foo@social.bar or foo@barmastodonbla
 # We do not match everything of the form foo@bar or foo@bar.bla to avoid false positives like email addresses
@@ -81,11 +102,46 @@ _id_pattern2 = re.compile(r'\b((http://|https://)?([\w\-\.]+\.[\w\-\.]+)/(web/)?
 _url_path_pattern = re.compile(r'^/(@|web/@?)([\w\-\.]+)(/.*|[.:,;!?()\[\]{}].*)?$', re.IGNORECASE)
 _profile_page_pattern = re.compile(r'https?://webfinger.net/rel/profile-page', re.IGNORECASE)
 
+# A set of host names, stored as a trie keyed on the reversed labels of the host names, i.e.
+# 'jabber.ccc.de' is stored under 'de' -> 'ccc' -> 'jabber'. Hosts can be added either with all their
+# subdomains or on their own. Checking whether a host (or one of its parent domains) is in the set
+# takes a single walk over the host's labels.
+class HostSuffixTrie:
+    # key that marks the end of a host name in a node; the value says whether subdomains are included
+    _END = None
+
+    def __init__(self, hosts = (), subdomains = True):
+        self.root = dict()
+        self.size = 0
+        self.update(hosts, subdomains = subdomains)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, host, subdomains = True):
+        node = self.root
+        for label in reversed(host.lower().split('.')):
+            node = node.setdefault(label, dict())
+        if node.get(HostSuffixTrie._END) is None: self.size += 1
+        node[HostSuffixTrie._END] = node.get(HostSuffixTrie._END) or subdomains
+
+    def update(self, hosts, subdomains = True):
+        for host in hosts:
+            self.add(host, subdomains = subdomains)
+
+    def matches(self, host):
+        node = self.root
+        for label in reversed(host.lower().split('.')):
+            node = node.get(label)
+            if node is None: return False
+            if node.get(HostSuffixTrie._END): return True
+        return HostSuffixTrie._END in node
+
+_forbidden_host_trie = HostSuffixTrie(_forbidden_hosts)
+
+# Whether the host or one of its parent domains is in our hard-coded list of forbidden hosts
 def is_forbidden_host(h):
-    xs = h.lower().split('.')
-    for i in range(0, len(xs)):
-        if '.'.join(xs[i:]) in _forbidden_hosts: return True
-    return False
+    return _forbidden_host_trie.matches(h)
 
 def matches_host_heuristic(s):
     xs = s.lower().split('.')
@@ -98,19 +154,28 @@ _mastodon_id_pattern = re.compile('[\w\-\.]+')
 def is_valid_mastodon_id(s):
     return _mastodon_id_pattern.match(s) is not None
 
+# forbidden_host_callback: decides whether a host must never be accepted; defaults to is_forbidden_host
 class InstanceValidator:
-    def __init__(self, known_host_callback=None, mode='strict'):
+    def __init__(self, known_host_callback=None, mode='strict', forbidden_host_callback=None):
         if known_host_callback is None:
             self.known_host_callback = (lambda x: False)
         else:
             self.known_host_callback = known_host_callback
+        if forbidden_host_callback is None:
+            self.forbidden_host_callback = is_forbidden_host
+        else:
+            self.forbidden_host_callback = forbidden_host_callback
         self.mode = mode
 
-    def validate_host(self, h):
+    # known_hosts: if given, a set of (lower case) hosts that have already been looked up in bulk
+    #   (see MastodonIdExtractor.resolve_known_hosts); it is then used instead of known_host_callback
+    def validate_host(self, h, known_hosts = None):
         s = h.lower()
-        if is_forbidden_host(s): return False
+        if self.forbidden_host_callback(s): return False
         
-        if self.known_host_callback is None:
+        if known_hosts is not None:
+            callback_result = s in known_hosts
+        elif self.known_host_callback is None:
             callback_result = None
         else:
             callback_result = self.known_host_callback(s)
@@ -126,18 +191,139 @@ class InstanceValidator:
         return False
     
     # for modes see "is_fediverse_host"
-    def make_mastodon_id(self, u, h, original = None):
+    def make_mastodon_id(self, u, h, original = None, known_hosts = None):
         if not is_valid_mastodon_id(u):
             return None
-        elif self.validate_host(h):
+        elif self.validate_host(h, known_hosts = known_hosts):
             return MastodonID(u, h, original = original)
         else:
             return None
 
 
+# An in-memory index of the known Fediverse instances (i.e. of the 'instances' table), so that hosts
+# can be validated without any database queries. It is loaded on first use; after that, a background
+# thread reloads it every refresh_interval seconds. Hosts that are not in the table at all are
+# collected and handed to record_unknown_callback in bulk by the same thread every flush_interval
+# seconds.
+#   load_callback: returns an iterable of pairs (host name, whether the instance's software is known)
+#   record_unknown_callback: takes a list of host names that are not in the table
+#   load_bad_hosts_callback: returns an iterable of host names that are known not to be Fediverse
+#     instances (i.e. the 'bad_hosts' table); these are blocked in addition to the hard-coded
+#     forbidden hosts (see is_forbidden)
+# Note that under uWSGI, the background thread only runs if threads are enabled.
+class KnownInstanceIndex:
+    def __init__(self, load_callback, record_unknown_callback = None, load_bad_hosts_callback = None, refresh_interval = 3600, flush_interval = 60):
+        self.load_callback = load_callback
+        self.record_unknown_callback = record_unknown_callback
+        self.load_bad_hosts_callback = load_bad_hosts_callback
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        # a pair (all host names, host names with known software); always replaced as a whole so
+        # that readers never need a lock
+        self._index = (frozenset(), frozenset())
+        self._forbidden = _forbidden_host_trie
+        self._unknown = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_refresh = None
+        self.last_refresh_duration = None
+        self.bad_hosts_error = None # the exception from the last attempt to load the bad hosts, if it failed
+
+    def __len__(self):
+        return len(self._index[0])
+
+    def refresh(self):
+        t = time.monotonic()
+        names = set()
+        known = set()
+        for name, has_software in self.load_callback():
+            name = sys.intern(name.lower())
+            names.add(name)
+            if has_software: known.add(name)
+        if self.load_bad_hosts_callback is not None:
+            # if the bad hosts cannot be loaded, the ones we have are kept (and the index is refreshed anyway)
+            try:
+                forbidden = HostSuffixTrie(_forbidden_hosts)
+                forbidden.update(self.load_bad_hosts_callback(), subdomains = False)
+                self._forbidden = forbidden
+                self.bad_hosts_error = None
+            except Exception as e:
+                self.bad_hosts_error = e
+                print('Failed to load bad hosts, keeping the previous ones:')
+                traceback.print_exc()
+        self._index = (frozenset(names), frozenset(known))
+        self.last_refresh = time.monotonic()
+        self.last_refresh_duration = self.last_refresh - t
+
+    def flush_unknown(self):
+        with self._lock:
+            hosts, self._unknown = self._unknown, set()
+        if hosts and self.record_unknown_callback is not None:
+            self.record_unknown_callback(sorted(hosts))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_unknown()
+                if self.last_refresh is None or time.monotonic() - self.last_refresh >= self.refresh_interval:
+                    self.refresh()
+            except Exception as e:
+                print('Failed to refresh known instances:', e)
+
+    def ensure_loaded(self):
+        if self._thread is not None: return
+        with self._lock:
+            if self._thread is not None: return
+            try:
+                self.refresh()
+            except Exception as e:
+                print('Failed to load known instances:', e)
+            self._thread = threading.Thread(target = self._run, daemon = True)
+            self._thread.start()
+
+    # Can be used as forbidden_host_callback of a MastodonIdExtractor or InstanceValidator
+    def is_forbidden(self, host):
+        self.ensure_loaded()
+        return self._forbidden.matches(host)
+
+    # Can be used as known_hosts_callback of a MastodonIdExtractor
+    def known_hosts(self, hosts):
+        self.ensure_loaded()
+        names, known = self._index
+        unknown = [h for h in hosts if h not in names]
+        if unknown:
+            with self._lock:
+                self._unknown.update(unknown)
+        return known.intersection(hosts)
+
+    # Can be used as known_host_callback of an InstanceValidator
+    def is_known(self, host):
+        return bool(self.known_hosts([host]))
+
+
 # Matches some key words that might occur in bios
 _keyword_pattern = re.compile(r'.*(mastodon|toot|tröt|fedi).*', re.IGNORECASE)
 
+# Finds, in a single pass over a text, everything that the more expensive patterns above (and the
+# URL extractor) need in order to match anything at all:
+#   1. '/@' or '/web/@' (needed by _id_pattern2 and by profile URLs)
+#   2. '/web/' (needed by profile URLs of the form bar.tld/web/foo)
+#   3. '@' (needed by _id_pattern1)
+#   4. any of the keywords of _keyword_pattern
+# Fields without any of these are never handed to the other patterns, which saves most of the work
+# since the vast majority of names and bios contain none of them.
+_trigger_pattern = re.compile(r'(/(?:web/)?@)|(/web/)|(@)|(mastodon|toot|tröt|fedi)', re.IGNORECASE)
+_TRIGGER_PATH_ID = 1
+_TRIGGER_WEB_PATH = 2
+_TRIGGER_AT = 3
+_TRIGGER_KEYWORD = 4
+
+# returns the set of triggers (see _trigger_pattern) that occur in the given text
+def scan_text(s):
+    if not s: return set()
+    return {m.lastindex for m in _trigger_pattern.finditer(s)}
+
 def parse_hostmeta(s):
     try:
         t = ET.fromstring(s)
@@ -145,10 +331,14 @@ def parse_hostmeta(s):
     except ET.ParseError:
         return None
 
+# There are many of these (one for every account found), so they have no __dict__, and the host
+# part is interned since most accounts are on a small number of big instances.
 class MastodonID:
+    __slots__ = ('user_part', 'host_part', 'original', 'exists', '_webfinger_template')
+
     def __init__(self, user_part, host_part, original = None):
         self.user_part = user_part.lower()
-        self.host_part = host_part.lower()
+        self.host_part = sys.intern(host_part.lower())
         self.original = original
         self.exists = None
         self._webfinger_template = None
@@ -204,7 +394,13 @@ class MastodonID:
         return None
         
 
+# Membership of Mastodon IDs and extras is tracked in sets so that merging is linear; the sets are
+# only built once a result is actually merged with another one. After a merge, the lists are only
+# sorted again when they are next accessed. Like MastodonID, this class has no __dict__.
 class UserResult:
+    __slots__ = ('uid', 'src', 'name', 'screenname', 'bio', '_mastodon_ids', '_mastodon_id_set', '_mastodon_ids_sorted',
+        '_extras', '_extra_set', '_extras_sorted')
+
     def __init__(self, uid, src, name, screenname, bio, mastodon_ids, extras):
         self.uid = str(uid)
         self.src = src
@@ -213,21 +409,55 @@ class UserResult:
         self.bio = bio
         self.mastodon_ids = mastodon_ids
         self.extras = extras
-        self.is_on_fediverse = bool(self.mastodon_ids)
+
+    @property
+    def mastodon_ids(self):
+        if not self._mastodon_ids_sorted:
+            self._mastodon_ids.sort(key=str)
+            self._mastodon_ids_sorted = True
+        return self._mastodon_ids
+
+    @mastodon_ids.setter
+    def mastodon_ids(self, mastodon_ids):
+        self._mastodon_ids = mastodon_ids
+        self._mastodon_id_set = None
+        self._mastodon_ids_sorted = True
+
+    @property
+    def extras(self):
+        if not self._extras_sorted:
+            self._extras.sort()
+            self._extras_sorted = True
+        return self._extras
+
+    @extras.setter
+    def extras(self, extras):
+        self._extras = extras
+        self._extra_set = None
+        self._extras_sorted = True
+
+    @property
+    def is_on_fediverse(self):
+        return bool(self._mastodon_ids)
         
     def merge(self, r):
         if r.uid != self.uid: return
-        if r.mastodon_ids is not None:
-            for mid in r.mastodon_ids:
-                if mid not in self.mastodon_ids:
-                   self.mastodon_ids.append(mid)
-            self.mastodon_ids.sort(key=str)
-        if r.extras is not None:
-            for extra in r.extras:
-               if extra not in self.extras:
-                   self.extras.append(extra)
-            self.extras.sort()
-        self.is_on_fediverse = bool(self.mastodon_ids)
+        if r._mastodon_ids is not None:
+            if self._mastodon_ids is None: self._mastodon_ids = list()
+            if self._mastodon_id_set is None: self._mastodon_id_set = set(self._mastodon_ids)
+            for mid in r._mastodon_ids:
+                if mid not in self._mastodon_id_set:
+                   self._mastodon_id_set.add(mid)
+                   self._mastodon_ids.append(mid)
+            self._mastodon_ids_sorted = False
+        if r._extras is not None:
+            if self._extras is None: self._extras = list()
+            if self._extra_set is None: self._extra_set = set(self._extras)
+            for extra in r._extras:
+               if extra not in self._extra_set:
+                   self._extra_set.add(extra)
+                   self._extras.append(extra)
+            self._extras_sorted = False
         
     def to_json(self):
         mids = [str(mid) for mid in self.mastodon_ids]
@@ -286,8 +516,10 @@ class Results:
     def __init__(self):
         self.results = dict()
         self.n_users = 0
+        self._sorted_results = None
         
     def add(self, r):
+        self._sorted_results = None
         if r.uid in self.results:
             self.results[r.uid].merge(r)
         else:
@@ -298,67 +530,135 @@ class Results:
             self.add(r)
         self.n_users += rs.n_users
 
+    def add_page(self, page):
+        for r in page.results:
+            self.add(r)
+        self.n_users += page.n_users
+
+    # Returns the users with Mastodon IDs, the users with only keyword matches and all users, each
+    # sorted by screen name. The lists are computed on first access and cached until the next call of
+    # add/merge, so callers must not modify them.
     def get_results(self):
-        mid_results = [r for r in self.results.values() if r.mastodon_ids]
-        mid_results.sort(key=(lambda u: u.screenname))
-        extra_results = [r for r in self.results.values() if not r.mastodon_ids and r.extras]
-        extra_results.sort(key=(lambda u: u.screenname))
-        all_results = list(self.results.values())
-        all_results.sort(key=(lambda u: u.screenname))
-        return mid_results, extra_results, all_results
+        if self._sorted_results is None:
+            all_results = list(self.results.values())
+            all_results.sort(key=(lambda u: u.screenname))
+            mid_results = [r for r in all_results if r.mastodon_ids]
+            extra_results = [r for r in all_results if not r.mastodon_ids and r.extras]
+            self._sorted_results = (mid_results, extra_results, all_results)
+        return self._sorted_results
+
+# One page of results as produced by the iter_mastodon_ids_from_* generators, together with running
+# totals over all pages produced so far.
+class ResultsPage:
+    def __init__(self, page, results, n_users, total_users, total_found, total_ids):
+        self.page = page # starting at 1
+        self.results = results # list of UserResult objects
+        self.n_users = n_users # number of users on this page
+        self.total_users = total_users # number of users on all pages so far
+        self.total_found = total_found # number of users with at least one Mastodon ID so far
+        self.total_ids = total_ids # number of Mastodon IDs found so far
+
+class _PageCounter:
+    def __init__(self):
+        self.page = 0
+        self.total_users = 0
+        self.total_found = 0
+        self.total_ids = 0
+
+    def next_page(self, results, n_users):
+        self.page += 1
+        self.total_users += n_users
+        for r in results:
+            if r.mastodon_ids:
+                self.total_found += 1
+                self.total_ids += len(r.mastodon_ids)
+        return ResultsPage(self.page, results, n_users, self.total_users, self.total_found, self.total_ids)
 
 def is_mastodon_id_char(s):
     return s.isalnum() or s == '_'
 
-def mk_mastodon_id_from_url(validator, url_str):
+# Takes a URL of the form bar.tld/@foo or bar.tld/web/@foo and returns the pair (foo, bar.tld),
+# or None if the URL does not have that form
+def parse_mastodon_id_url(url_str):
     try:
         url = urlparse(url_str)
         if url.scheme not in ('', 'http', 'https'):
             return None
         h_str = url.hostname
         match = _url_path_pattern.match(url.path)
-        u_str = match[2]
-        return validator.make_mastodon_id(u_str, h_str, original = url_str)
+        if h_str is None or match is None:
+            return None
+        return match[2], h_str
     except Exception as e:
         return None
 
-# client: a tweepy.Client object
-# requested_user: a tweepy.User object
-# returns:
-#   a tuple consisting of two lists UserResult objects.
-#   the first component contains a list of users that seem to have a Mastodon ID in their name or bio
-#   the second component contains a list of users that have some keyword in their bio that looks Mastodon-related
-def extract_mastodon_ids_from_users(client, get_src, resp, results, known_host_callback = None):
-    if resp.data is None: return
-    lax_validator = InstanceValidator(known_host_callback=known_host_callback, mode = 'lax')
-    strict_validator = InstanceValidator(known_host_callback=known_host_callback, mode = 'strict')
-    extractor = URLExtract()
-    
-    # Takes a Mastodon ID in the format @foo@bar.tld or foo@bar.tld and returns
-    # a MastodonID object. If the string starts with an @, lax host validation is performed
-    def parse_mastodon_id(s, certain = False):
-        validator = strict_validator
+def mk_mastodon_id_from_url(validator, url_str):
+    x = parse_mastodon_id_url(url_str)
+    if x is None: return None
+    try:
+        return validator.make_mastodon_id(x[0], x[1], original = url_str)
+    except Exception as e:
+        return None
+
+# Holds everything that is needed to extract Mastodon IDs from Twitter users: the URL extractor
+# (with its TLD tables) and the lax and strict host validators. Building one is comparatively
+# expensive, so it is meant to be built once at startup and then reused for every page of users.
+# After construction, it is never mutated (apart from lazily starting its process pool), so it can
+# be shared between threads.
+#
+# Host validation can be done in two ways:
+#   known_host_callback: called once for every candidate host (see InstanceValidator)
+#   known_hosts_callback: called once for every page of users with the set of all candidate hosts
+#     (in lower case) on that page; returns the subset of them that are known. This is preferable
+#     when the lookup is a database query. If given, known_host_callback is not used.
+# forbidden_host_callback: see InstanceValidator
+# workers: if positive, the first phase of the extraction (which is pure regex work) is done for
+#   large pages of users in a pool of that many processes, in slices of slice_size users. Host
+#   validation is always done in the calling process, so the callbacks need not be picklable.
+class MastodonIdExtractor:
+    def __init__(self, known_host_callback = None, known_hosts_callback = None, forbidden_host_callback = None, workers = 0, slice_size = 250):
+        self.lax_validator = InstanceValidator(known_host_callback=known_host_callback, mode = 'lax', forbidden_host_callback = forbidden_host_callback)
+        self.strict_validator = InstanceValidator(known_host_callback=known_host_callback, mode = 'strict', forbidden_host_callback = forbidden_host_callback)
+        self.known_hosts_callback = known_hosts_callback
+        self.url_extractor = URLExtract()
+        self.workers = workers
+        self.slice_size = slice_size
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    # Takes a Mastodon ID in the format @foo@bar.tld or foo@bar.tld and returns a candidate, i.e.
+    # a tuple (certain, user part, host part, original form). If the string starts with an @, the
+    # ID is 'certain' and lax host validation is performed; otherwise, strict validation is used.
+    def parse_mastodon_id_candidate(self, s, certain = False):
         if not is_mastodon_id_char(s[-1:]): s = s[:-1] # remove possible trailing punctuation
-        if certain: validator = lax_validator
         tmp = s.split('@')
         if len(tmp) != 2:
             return None
-        return validator.make_mastodon_id(tmp[0], tmp[1], original = s)
+        return (certain, tmp[0], tmp[1], s)
 
-    users = resp.data
-    if 'id' in users: users = [users]    
-    
-    if not users: return
-    pinned_tweets = resp.includes.get('tweets') or []
-    if pinned_tweets is None: pinned_tweets = []
-    pinned_tweets = {t.id: t for t in pinned_tweets}
-    
-    for u in users:
-        if u is None: continue
-        uid = u.id
+    def validator_for(self, certain):
+        if certain:
+            return self.lax_validator
+        else:
+            return self.strict_validator
+
+    # Like parse_mastodon_id_candidate, but returns a validated MastodonID object (or None)
+    def parse_mastodon_id(self, s, certain = False):
+        candidate = self.parse_mastodon_id_candidate(s, certain = certain)
+        if candidate is None: return None
+        certain, u_str, h_str, original = candidate
+        return self.validator_for(certain).make_mastodon_id(u_str, h_str, original = original)
+
+    # First phase of the extraction: finds everything in the user's profile that looks like a
+    # Mastodon ID, without validating the hosts yet.
+    # u: a tweepy.User object
+    # pinned_tweets: a dict mapping tweet IDs to tweepy.Tweet objects
+    # returns a list of candidates (see parse_mastodon_id_candidate), in the order in which they
+    # were found, and the triggers found in the bio (see scan_text)
+    def collect_candidates(self, u, pinned_tweets):
         name = u.name
         location = u.location
-        screenname = u.username
         bio = u.description
         if u.pinned_tweet_id is not None:
             pinned_tweet = pinned_tweets.get(u.pinned_tweet_id)
@@ -370,54 +670,189 @@ def extract_mastodon_ids_from_users(client, get_src, resp, results, known_host_c
             pinned_tweet = None
             pinned_tweet_text = ""
             
-        extras = None
-        mastodon_ids = set()
+        candidates = list()
+
+        # Scan every field exactly once to find out which of the checks below can possibly match.
+        # The checks themselves are still done in the same order as before since the first match
+        # of a Mastodon ID determines its 'original' form.
+        texts = (name, location, bio, pinned_tweet_text)
+        triggers = [scan_text(s) for s in texts]
+        bio_triggers = triggers[2]
+        fields = [(s, t) for s, t in zip(texts, triggers) if s is not None]
 
         # Parse Mastodon IDs of the form @foo@bar.tld or foo@bar.tld
         # Strict host validation is performed in the second form (i.e. must not be forbidden,
         # must pass heuristic or be a known host)
-        for text in [name, location, bio, pinned_tweet_text]:
-            if text is None: continue
+        for text, triggers in fields:
+            if _TRIGGER_AT not in triggers and _TRIGGER_PATH_ID not in triggers: continue
             for prefix, s in _id_pattern1.findall(text):
                 certain = False
                 if prefix: certain = True
-                mid = parse_mastodon_id(s, certain = certain)
-                if mid is not None: mastodon_ids.add(mid)
+                candidate = self.parse_mastodon_id_candidate(s, certain = certain)
+                if candidate is not None: candidates.append(candidate)
 
         # Now we check for URLs of the form bar.tld/@foo or bar.tld/web/@foo
         # Strict validation is always used.
         
         # check URLs in entities
         for url in extract_urls_from_user(u) + extract_urls_from_tweet(pinned_tweet):
-            mid = mk_mastodon_id_from_url(strict_validator, url)
-            if mid is not None: mastodon_ids.add(mid)
+            x = parse_mastodon_id_url(url)
+            if x is not None: candidates.append((False, x[0], x[1], url))
 
         # Check for weird malformed pure text URLs
-        for s in (name, location, bio, pinned_tweet_text):
-            if s is None: continue
+        for s, triggers in fields:
+            if _TRIGGER_PATH_ID not in triggers: continue
             for entire_match, _, h_str, _, u_str in _id_pattern2.findall(s):
-                mid = strict_validator.make_mastodon_id(u_str, h_str, original = entire_match)
-                if mid is not None: mastodon_ids.add(mid)
-
-        # Check for pure text URLs
-        for s in (name, location, bio, pinned_tweet_text):
-            if s is None: continue
-            for url in extractor.find_urls(s):
-                mid = mk_mastodon_id_from_url(strict_validator, url)
-                if mid is not None: mastodon_ids.add(mid)
+                candidates.append((False, u_str, h_str, entire_match))
+
+        # Check for pure text URLs (only the paths /@foo and /web/foo can lead to a Mastodon ID)
+        for s, triggers in fields:
+            if _TRIGGER_PATH_ID not in triggers and _TRIGGER_WEB_PATH not in triggers: continue
+            for url in self.url_extractor.find_urls(s):
+                x = parse_mastodon_id_url(url)
+                if x is not None: candidates.append((False, x[0], x[1], url))
+
+        return candidates, bio_triggers
+
+    # Looks up all hosts occurring in the given lists of candidates with a single call of the
+    # known_hosts_callback. Returns the set of known hosts, or None if there is no such callback.
+    def resolve_known_hosts(self, candidate_lists):
+        if self.known_hosts_callback is None: return None
+        is_forbidden = self.strict_validator.forbidden_host_callback
+        hosts = {h_str.lower() for candidates in candidate_lists for _, u_str, h_str, _ in candidates
+                    if is_valid_mastodon_id(u_str) and not is_forbidden(h_str)}
+        if not hosts: return set()
+        return set(self.known_hosts_callback(hosts))
+
+    # Second phase of the extraction: validates the candidates and builds the UserResult object.
+    def make_user_result(self, u, src, candidates, bio_triggers, known_hosts = None):
+        extras = None
+        mastodon_ids = set()
+        for certain, u_str, h_str, original in candidates:
+            mid = self.validator_for(certain).make_mastodon_id(u_str, h_str, original = original, known_hosts = known_hosts)
+            if mid is not None: mastodon_ids.add(mid)
         
         mastodon_ids = list(mastodon_ids)
         mastodon_ids.sort(key=(lambda mid: str(mid)))
         
         if not mastodon_ids:
           extras = list()
-          for d in u.description.splitlines():
-              if _keyword_pattern.match(d): extras.append(d)
+          if _TRIGGER_KEYWORD in bio_triggers:
+              for d in u.description.splitlines():
+                  if _keyword_pattern.match(d): extras.append(d)
           if not extras: extras = None
         
-        src = None
-        if get_src is not None: src = get_src(u)
-        results.add(UserResult(uid, src, name, screenname, bio, mastodon_ids, extras))
+        # the bio is not needed anymore once it has been searched (the relevant lines are in extras)
+        return UserResult(u.id, src, u.name, u.username, None, mastodon_ids, extras)
+
+    # Starts the process pool (if workers is positive). Called once at startup, so that the first
+    # search that needs the pool does not have to wait for it. The worker processes are started by a
+    # fork server: forking this process directly is not safe, since other threads (caches, index
+    # refreshes, probes) may be holding locks at that moment. If the pool cannot be started, the
+    # extraction is done in this process (like in collect_candidates_in_pool when a worker dies).
+    def start_pool(self):
+        if self.workers <= 0: return
+        try:
+            self._get_pool().submit(int).result()
+        except BrokenProcessPool as e:
+            print('Could not start the extraction workers, extracting in this process instead:', e)
+            with self._pool_lock:
+                self._pool = None
+            self.workers = 0
+
+    def _get_pool(self):
+        with self._pool_lock:
+            # a process forked after the pool was created (e.g. a preforking server's worker) needs a pool of its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers = self.workers, initializer = _init_extraction_worker,
+                    mp_context = multiprocessing.get_context('forkserver'))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    # Like collect_candidates, but for a list of users that is split into slices that are processed
+    # in the process pool. The results are returned in the same order as the users.
+    def collect_candidates_in_pool(self, users, pinned_tweets):
+        # tweepy objects cannot be pickled, so we send the raw API data and rebuild them in the workers
+        slices = list()
+        for i in range(0, len(users), self.slice_size):
+            us = users[i:i + self.slice_size]
+            tweets = {u.pinned_tweet_id: pinned_tweets[u.pinned_tweet_id].data for u in us if u.pinned_tweet_id in pinned_tweets}
+            slices.append(([u.data for u in us], tweets))
+        try:
+            collected = list()
+            for xs in self._get_pool().map(_collect_candidates_in_worker, slices):
+                collected += xs
+            return collected
+        except BrokenProcessPool as e:
+            print('Extraction worker died, falling back to extraction in this process:', e)
+            with self._pool_lock:
+                self._pool = None
+            return [self.collect_candidates(u, pinned_tweets) for u in users]
+
+    # u: a tweepy.User object
+    # pinned_tweets: a dict mapping tweet IDs to tweepy.Tweet objects
+    # returns a UserResult object
+    def extract_from_user(self, u, pinned_tweets, src = None):
+        candidates, bio_triggers = self.collect_candidates(u, pinned_tweets)
+        known_hosts = self.resolve_known_hosts([candidates])
+        return self.make_user_result(u, src, candidates, bio_triggers, known_hosts = known_hosts)
+
+    # resp: a tweepy.Response object containing users (and possibly their pinned tweets)
+    # returns a list of UserResult objects, one for each user in the response
+    # All candidate hosts of the page are resolved at once before any of the users are validated.
+    def extract_users(self, get_src, resp):
+        if resp.data is None: return []
+        users = resp.data
+        if 'id' in users: users = [users]    
+        
+        if not users: return []
+        pinned_tweets = resp.includes.get('tweets') or []
+        if pinned_tweets is None: pinned_tweets = []
+        pinned_tweets = {t.id: t for t in pinned_tweets}
+        
+        users = [u for u in users if u is not None]
+        if self.workers > 0 and len(users) >= 2 * self.slice_size:
+            collected = self.collect_candidates_in_pool(users, pinned_tweets)
+        else:
+            collected = [self.collect_candidates(u, pinned_tweets) for u in users]
+        known_hosts = self.resolve_known_hosts([candidates for candidates, _ in collected])
+        user_results = list()
+        for u, (candidates, bio_triggers) in zip(users, collected):
+            src = None
+            if get_src is not None: src = get_src(u)
+            user_results.append(self.make_user_result(u, src, candidates, bio_triggers, known_hosts = known_hosts))
+        return user_results
+
+    # Like extract_users, but adds the UserResult objects to the given Results object
+    def extract(self, get_src, resp, results):
+        for r in self.extract_users(get_src, resp):
+            results.add(r)
+
+# Each process of a MastodonIdExtractor's process pool has its own extractor without any callbacks;
+# it only ever runs the first phase of the extraction.
+_worker_extractor = None
+
+def _init_extraction_worker():
+    global _worker_extractor
+    _worker_extractor = MastodonIdExtractor()
+
+def _collect_candidates_in_worker(args):
+    user_data, pinned_tweet_data = args
+    pinned_tweets = {tid: tweepy.Tweet(data) for tid, data in pinned_tweet_data.items()}
+    return [_worker_extractor.collect_candidates(tweepy.User(data), pinned_tweets) for data in user_data]
+
+# client: a tweepy.Client object
+# requested_user: a tweepy.User object
+# extractor: a MastodonIdExtractor; if none is given, a fresh one is built from known_host_callback.
+#   Callers that process more than one response should build one and pass it in.
+# returns:
+#   a tuple consisting of two lists UserResult objects.
+#   the first component contains a list of users that seem to have a Mastodon ID in their name or bio
+#   the second component contains a list of users that have some keyword in their bio that looks Mastodon-related
+def extract_mastodon_ids_from_users(client, get_src, resp, results, known_host_callback = None, extractor = None):
+    if resp.data is None: return
+    if extractor is None: extractor = MastodonIdExtractor(known_host_callback)
+    extractor.extract(get_src, resp, results)
 
 def chunks_of(seq, size):
     return iter(partial(lambda it: tuple(islice(it, size)), iter(seq)), ())
@@ -501,10 +936,53 @@ def extract_mastodon_ids_from_users_raw(client, src, users, known_host_callback
 
     return results, errors
 
-def extract_mastodon_ids_from_pseudolist(client, requested_user, pl, known_host_callback = None):
+# Runs the given generator in a background thread so that it can work on the next items (e.g.
+# fetch the next pages from Twitter) while the caller processes the current one. At most
+# 'lookahead' items are produced ahead of the caller. Exceptions raised by the generator are
+# re-raised in the caller.
+def prefetched(gen, lookahead = None):
+    if lookahead is None: lookahead = prefetch_pages
+    if lookahead <= 0:
+        yield from gen
+        return
+
+    items = queue.Queue()
+    slots = threading.Semaphore(lookahead)
+    stop = threading.Event()
+
+    def run():
+        try:
+            while True:
+                while not slots.acquire(timeout = 0.1):
+                    if stop.is_set(): return
+                if stop.is_set(): return
+                try:
+                    x = next(gen)
+                except StopIteration:
+                    items.put((False, None))
+                    return
+                items.put((True, x))
+        except BaseException as e:
+            items.put((False, e))
+
+    threading.Thread(target = run, daemon = True).start()
+    try:
+        while True:
+            ok, x = items.get()
+            if ok:
+                slots.release()
+                yield x
+            elif x is None:
+                return
+            else:
+                raise x
+    finally:
+        stop.set()
+
+# Fetches the users of a pseudolist page by page; yields tweepy.Response objects
+def _pseudolist_pages(client, requested_user, pl):
     next_token = None
     pages = 1
-    results = Results()
 
     while pages <= pl.page_limit:
         api_call = getattr(client, pl.api_call)
@@ -535,23 +1013,38 @@ def extract_mastodon_ids_from_pseudolist(client, requested_user, pl, known_host_
         except:
           next_token = None
 
-        users = resp.data
-        if users is None: users = []
-        extract_mastodon_ids_from_users(client, lambda x: pl.name, resp, results, known_host_callback=known_host_callback)
+        yield resp
         pages = pages + 1
-        results.n_users += len(users)
        
         if next_token is None:
             break
 
+# Generator variant of extract_mastodon_ids_from_pseudolist: yields a ResultsPage as soon as each
+# page of the pseudolist has been fetched and processed, so that callers need not hold the results
+# of all pages at once. While a page is processed, the next one is already being fetched
+# (see prefetched).
+def iter_mastodon_ids_from_pseudolist(client, requested_user, pl, known_host_callback = None, extractor = None, lookahead = None):
+    counter = _PageCounter()
+    if extractor is None: extractor = MastodonIdExtractor(known_host_callback)
+
+    for resp in prefetched(_pseudolist_pages(client, requested_user, pl), lookahead):
+        users = resp.data
+        if users is None: users = []
+        yield counter.next_page(extractor.extract_users(lambda x: pl.name, resp), len(users))
+
+def extract_mastodon_ids_from_pseudolist(client, requested_user, pl, known_host_callback = None, extractor = None):
+    results = Results()
+    for page in iter_mastodon_ids_from_pseudolist(client, requested_user, pl, known_host_callback = known_host_callback, extractor = extractor):
+        results.add_page(page)
     return results
-    
-def extract_mastodon_ids_from_lists(client, requested_list_ids, known_host_callback=None):
-    next_token = None
+
+# Fetches the members of the given lists page by page; yields pairs (source, tweepy.Response).
+# At most max_list_member_pages pages are fetched in total over all lists.
+def _list_member_pages(client, requested_list_ids):
     pages = 1
-    results = Results()
 
     for list_id in requested_list_ids:
+        next_token = None
         resp = client.get_list(list_id, user_auth = True)
         name = resp.data.name
         src = 'List: ' + name
@@ -572,14 +1065,24 @@ def extract_mastodon_ids_from_lists(client, requested_list_ids, known_host_callb
             except:
               next_token = None
 
-            users = resp.data
-            if users is None: users = []
-            extract_mastodon_ids_from_users(client, lambda x: src, resp, results, known_host_callback=known_host_callback)
+            yield src, resp
             pages = pages + 1
-            results.n_users += len(users)
            
             if next_token is None:
                 break
 
-    return results
+# Generator variant of extract_mastodon_ids_from_lists (see iter_mastodon_ids_from_pseudolist)
+def iter_mastodon_ids_from_lists(client, requested_list_ids, known_host_callback=None, extractor=None, lookahead=None):
+    counter = _PageCounter()
+    if extractor is None: extractor = MastodonIdExtractor(known_host_callback)
 
+    for src, resp in prefetched(_list_member_pages(client, requested_list_ids), lookahead):
+        users = resp.data
+        if users is None: users = []
+        yield counter.next_page(extractor.extract_users(lambda x: src, resp), len(users))
+
+def extract_mastodon_ids_from_lists(client, requested_list_ids, known_host_callback=None, extractor=None):
+    results = Results()
+    for page in iter_mastodon_ids_from_lists(client, requested_list_ids, known_host_callback = known_host_callback, extractor = extractor):
+        results.add_page(page)
+    return results
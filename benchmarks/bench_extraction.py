@@ -0,0 +1,43 @@
+# Measures how many users per second the Mastodon ID extraction handles on a synthetic corpus.
+#
+# Usage: python3 benchmarks/bench_extraction.py [number of users] [page size]
+
+import sys
+import time
+
+import corpus
+from main import extract_mastodon_ids
+
+def known_host_callback(s):
+    return False
+
+def run(label, pages, n_users, callback):
+    t = time.perf_counter()
+    results = extract_mastodon_ids.Results()
+    for resp in pages:
+        callback(resp, results)
+    t = time.perf_counter() - t
+    mid_results, _, _ = results.get_results()
+    print(f'{label:<28} {t:8.2f} s  {n_users / t:10.0f} users/s  ({len(mid_results)} users with IDs)')
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    pages = corpus.make_pages(corpus.make_users(n_users), page_size)
+    print(f'{n_users} users in {len(pages)} pages')
+
+    # old behaviour: URL extractor and validators are set up anew for every page
+    def cold(resp, results):
+        extractor = extract_mastodon_ids.MastodonIdExtractor(known_host_callback)
+        extract_mastodon_ids.extract_mastodon_ids_from_users(None, None, resp, results, extractor = extractor)
+    run('fresh extractor per page', pages, n_users, cold)
+
+    t = time.perf_counter()
+    extractor = extract_mastodon_ids.MastodonIdExtractor(known_host_callback)
+    print(f'building an extractor takes {(time.perf_counter() - t) * 1000:.1f} ms')
+    def warm(resp, results):
+        extract_mastodon_ids.extract_mastodon_ids_from_users(None, None, resp, results, extractor = extractor)
+    run('shared extractor', pages, n_users, warm)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# Compares plain requests.head calls (a new TCP and TLS handshake for every request) with the pooled
+# keep-alive client in main/http_client.py against a local HTTPS server, sequentially and from a
+# thread pool (like verify_mastodon_ids does).
+#
+# Usage: python3 benchmarks/bench_http_client.py [number of requests] [threads]
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+import corpus
+import local_tls
+from main import http_client
+
+def run(n, threads, probe):
+    t = time.perf_counter()
+    if threads <= 1:
+        for _ in range(n): probe()
+    else:
+        with ThreadPoolExecutor(max_workers = threads) as executor:
+            for _ in executor.map(lambda i: probe(), range(n)): pass
+    return time.perf_counter() - t
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    server = local_tls.serve(local_tls.WebfingerHandler)
+    url = server.base_url + '/.well-known/webfinger?resource=acct:someone@localhost'
+
+    def plain():
+        requests.head(url, timeout = 2, allow_redirects = True, verify = server.certificate).raise_for_status()
+    def pooled():
+        http_client.head(url, kind = 'webfinger', verify = server.certificate).raise_for_status()
+
+    print(f'{n} HEAD requests to {server.base_url}')
+    for n_threads in (1, threads):
+        for name, probe in (('requests.head', plain), ('http_client.head', pooled)):
+            t = run(n, n_threads, probe)
+            print(f'{name:18} {n_threads:2} thread(s): {t:6.2f} s ({n / t:7.0f} requests/s, {t / n * 1000:6.2f} ms each)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Measures how long it takes to build the Instance objects for a results page with many instances,
+# with the display fields computed on the fly (pycountry lookup, formatting, strftime) and with the
+# display fields as stored by the refresh scripts (see main/instance_display.py), and how long
+# rendering the instance headers of the results page takes on top of that.
+#
+# Usage: python3 benchmarks/bench_instances.py [number of instances]
+
+import datetime
+import random
+import sys
+import time
+
+import corpus
+from django.conf import settings
+settings.configure(USE_TZ = False)
+import django
+django.setup()
+from django.template import Engine, Context
+
+from main.instance import Instance
+from main.instance_display import display_fields
+
+# the part of templates/displayresults.html that shows the instance headers
+template = Engine().from_string('''{% for i in instances %}
+  {% if i.icon %}<img src="/debirdify_static/service_icons/{{ i.icon }}" title="{{i.software|title}}">{% endif %}
+  <a href="https://{{ i.host|urlencode }}">{{ i.host }}</a>
+  {% if i.country is not none %}<span title="Server location: {{ i.country.name }}">{{ i.country.flag }}</span>{% endif %}
+  {% if i.software is not none %}{{ i.software|title }} {{ i.software_version }}{% endif %}
+  {% if i.stats is not none %}<br>{{ i.stats }}{% endif %}
+  {% if i.last_update_pretty is not none %}<br>last updated: {{ i.last_update_pretty }}{% endif %}
+{% endfor %}''')
+
+def make_rows(n, seed = 42):
+    rng = random.Random(seed)
+    countries = ['DE', 'US', 'FR', 'GB', 'NL', 'JP', 'AT', 'CH', 'FI', 'CA', None]
+    software = ['mastodon', 'mastodon', 'mastodon', 'pleroma', 'misskey', 'friendica', 'pixelfed', None]
+    rows = list()
+    for k in range(n):
+        users = rng.randint(1, 200000)
+        rows.append((f'instance{k}.social', None, rng.choice(software), '4.0.2', rng.random() < 0.5, users,
+            users // 5, users // 3, users * 40, datetime.datetime(2022, 12, 1) + datetime.timedelta(minutes = rng.randint(0, 50000)),
+            rng.uniform(90, 100), rng.choice(countries), False, True))
+    return rows
+
+def best_of(f, n = 5):
+    best = None
+    for _ in range(n):
+        t = time.perf_counter()
+        result = f()
+        t = time.perf_counter() - t
+        if best is None or t < best: best = t
+    return best, result
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rows = make_rows(n)
+    stored = [r + (display_fields(r[2], r[5], r[6], r[7], r[10], r[11], r[9]),) for r in rows]
+    print(f'{n} instances (best of 5)')
+    t1, computed = best_of(lambda: [Instance(*r) for r in rows])
+    print(f'build, display fields computed: {t1 * 1000:7.1f} ms')
+    t2, materialized = best_of(lambda: [Instance(*r[:14], display = r[14]) for r in stored])
+    print(f'build, display fields stored:   {t2 * 1000:7.1f} ms ({t1 / t2:.1f}x faster)')
+    assert [vars(i) for i in computed] == [vars(i) for i in materialized]
+    t3, _ = best_of(lambda: template.render(Context({'instances': materialized})))
+    print(f'rendering the instance headers: {t3 * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Measures reload time, memory use and lookup speed of the in-memory known instance index
+# (KnownInstanceIndex) for a table of synthetic instance names.
+#
+# Usage: python3 benchmarks/bench_known_instances.py [number of instances]
+
+import sys
+import time
+import random
+import tracemalloc
+
+import corpus
+from main import extract_mastodon_ids
+
+def make_rows(n, seed = 42):
+    rng = random.Random(seed)
+    tlds = ['social', 'com', 'org', 'net', 'de', 'xyz', 'io', 'online', 'community', 'town']
+    rows = set()
+    while len(rows) < n:
+        name = '.'.join(corpus._user_name(rng) for _ in range(rng.randint(1, 2))) + '.' + rng.choice(tlds)
+        rows.add((name, rng.random() < 0.8))
+    return list(rows)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    rows = make_rows(n)
+    index = extract_mastodon_ids.KnownInstanceIndex(lambda: rows)
+
+    tracemalloc.start()
+    index.refresh()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{len(index)} instances')
+    print(f'memory: {size / 1024 / 1024:.2f} MiB (peak during load: {peak / 1024 / 1024:.2f} MiB), {size / len(index):.0f} bytes per instance')
+
+    times = []
+    for _ in range(10):
+        index.refresh()
+        times.append(index.last_refresh_duration)
+    print(f'reload time (excluding the query): {min(times) * 1000:.1f} ms')
+
+    # the background thread is not needed for this benchmark
+    index._thread = True
+    hosts = [name for name, _ in rows[:500]] + [f'unknown{i}.example' for i in range(500)]
+    k = 2000
+    t = time.perf_counter()
+    for _ in range(k):
+        index.known_hosts(hosts)
+    t = time.perf_counter() - t
+    print(f'lookups: {k * len(hosts) / t / 1e6:.1f} million hosts/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Measures the memory held by a Results object after extraction, in bytes per user, using
+# tracemalloc. As in the web views, every page of input is discarded once it has been processed,
+# so only what the results keep alive is counted.
+#
+# Usage: python3 benchmarks/bench_memory.py [number of users] [max bytes per user]
+# If a maximum is given, the exit code is 1 if it is exceeded.
+
+import gc
+import sys
+import tracemalloc
+
+import corpus
+from main import extract_mastodon_ids
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    max_bytes = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    page_size = 1000
+    extractor = extract_mastodon_ids.MastodonIdExtractor(known_hosts_callback = lambda hosts: set(hosts))
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = extract_mastodon_ids.Results()
+    for offset in range(0, n_users, page_size):
+        resp, = corpus.make_pages(corpus.make_users(page_size, seed = offset, offset = offset), page_size)
+        extractor.extract(None, resp, results)
+        del resp
+    results.get_results()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    mid_results, extra_results, _ = results.get_results()
+    n_ids = sum(len(u.mastodon_ids) for u in mid_results)
+    per_user = size / n_users
+    print(f'{n_users} users ({len(mid_results)} with {n_ids} Mastodon IDs, {len(extra_results)} with keywords)')
+    print(f'results: {size / 1024 / 1024:.2f} MiB, {per_user:.0f} bytes per user')
+    if max_bytes is not None and per_user > max_bytes:
+        print(f'more than {max_bytes:.0f} bytes per user')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# Measures how extraction scales with the number of worker processes of a MastodonIdExtractor.
+#
+# Usage: python3 benchmarks/bench_parallel_extraction.py [number of users] [page size] [worker counts...]
+
+import os
+import sys
+import time
+
+import corpus
+from main import extract_mastodon_ids
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    worker_counts = [int(x) for x in sys.argv[3:]] or [0, 1, 2, 4, 8]
+    pages = corpus.make_pages(corpus.make_users(n_users), page_size)
+    print(f'{n_users} users in {len(pages)} pages, {os.cpu_count()} CPUs available')
+
+    reference = None
+    for workers in worker_counts:
+        extractor = extract_mastodon_ids.MastodonIdExtractor(known_hosts_callback = lambda hosts: set(), workers = workers)
+        # start the pool before measuring
+        extractor.start_pool()
+        results = extract_mastodon_ids.Results()
+        t = time.perf_counter()
+        for resp in pages:
+            extractor.extract(None, resp, results)
+        t = time.perf_counter() - t
+        found = [(r.uid, [str(mid) for mid in r.mastodon_ids]) for r in results.get_results()[0]]
+        if reference is None: reference = found
+        label = f'{workers} workers' if workers > 0 else 'in process'
+        print(f'{label:<12} {t:8.2f} s  {n_users / t:10.0f} users/s  {"" if found == reference else "(RESULTS DIFFER)"}')
+
+if __name__ == '__main__':
+    main()
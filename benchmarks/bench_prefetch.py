@@ -0,0 +1,43 @@
+# Measures the wall-clock time of a paginated pseudolist scan with and without fetching the next
+# page ahead, using a fake Twitter client that answers with the synthetic corpus after a fixed delay.
+#
+# Usage: python3 benchmarks/bench_prefetch.py [number of users] [fetch latency in seconds]
+
+import sys
+import time
+import tweepy
+
+import corpus
+from main import extract_mastodon_ids
+
+class FakeClient:
+    def __init__(self, pages, latency):
+        self.pages = pages
+        self.latency = latency
+
+    def get_users_following(self, uid, pagination_token = None, **kwargs):
+        time.sleep(self.latency)
+        i = int(pagination_token or 0)
+        meta = {'next_token': str(i + 1)} if i + 1 < len(self.pages) else {}
+        return tweepy.Response(self.pages[i].data, self.pages[i].includes, [], meta)
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 15000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    pages = corpus.make_pages(corpus.make_users(n_users), extract_mastodon_ids.pl_following.max_results)
+    client = FakeClient(pages, latency)
+    requested_user = tweepy.User({'id': '1', 'name': 'me', 'username': 'me'})
+    extractor = extract_mastodon_ids.MastodonIdExtractor(known_hosts_callback = lambda hosts: set())
+    print(f'{n_users} users in {len(pages)} pages, {latency * 1000:.0f} ms per fetch')
+
+    for lookahead in (0, 1, 2):
+        t = time.perf_counter()
+        n = 0
+        for page in extract_mastodon_ids.iter_mastodon_ids_from_pseudolist(
+                client, requested_user, extract_mastodon_ids.pl_following, extractor = extractor, lookahead = lookahead):
+            n = page.total_found
+        t = time.perf_counter() - t
+        print(f'lookahead {lookahead}: {t:6.2f} s ({n} users with IDs)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Measures the throughput (probes per second) and latency percentiles of the code that talks to
+# Fediverse servers, against the local stand-in in fake_fediverse.py:
+#   - MastodonID.query_exists and MastodonID.profile_url (each for fresh accounts, so nothing is
+#     answered from the caches) and verify_mastodon_ids for all of those accounts at once
+#   - test_host from retrieve_instance_info.py and test_instances.py (nodeinfo); these are skipped
+#     if the scripts' dependencies are not installed
+# Everything except verify_mastodon_ids runs on a pool of [threads] threads, like the scripts do.
+#
+# Usage: python3 benchmarks/bench_probes.py [number of probes] [threads] [mean latency in seconds]
+#   [error rate] [dead host rate] [malformed rate]
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import corpus
+import fake_fediverse
+from main import extract_mastodon_ids, http_client
+
+def percentile(xs, p):
+    return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+def run(name, n_threads, probe, args):
+    latencies = list()
+    def timed(x):
+        t = time.perf_counter()
+        probe(x)
+        latencies.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = n_threads) as executor:
+        for _ in executor.map(timed, args): pass
+    t = time.perf_counter() - t
+    latencies.sort()
+    print(f'{name:38} {len(args) / t:8.0f} probes/s   p50 {percentile(latencies, 0.5) * 1000:7.1f} ms   '
+        f'p95 {percentile(latencies, 0.95) * 1000:7.1f} ms   p99 {percentile(latencies, 0.99) * 1000:7.1f} ms')
+
+def accounts(fediverse, n, tag):
+    hosts = fediverse.hosts()
+    return [extract_mastodon_ids.MastodonID(f'{tag}{i}', hosts[i % len(hosts)]) for i in range(n)]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    fediverse = fake_fediverse.FakeFediverse(n_hosts = max(1, n // 10),
+        latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02,
+        error_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.01,
+        dead_rate = float(sys.argv[5]) if len(sys.argv) > 5 else 0.02,
+        malformed_rate = float(sys.argv[6]) if len(sys.argv) > 6 else 0.01).start()
+    fediverse.install_resolver()
+    print(f'{n} probes over {fediverse.n_hosts} hosts, {n_threads} threads, {fediverse.latency * 1000:.0f} ms mean latency, '
+        f'{fediverse.error_rate:.0%} errors, {fediverse.dead_rate:.0%} dead hosts, {fediverse.malformed_rate:.0%} malformed answers')
+
+    run('MastodonID.query_exists', n_threads, lambda mid: mid.query_exists(), accounts(fediverse, n, 'a'))
+    run('MastodonID.profile_url', n_threads, lambda mid: mid.profile_url(), accounts(fediverse, n, 'b'))
+
+    mids = accounts(fediverse, n, 'c')
+    t = time.perf_counter()
+    n_checked = extract_mastodon_ids.verify_mastodon_ids(mids, deadline = 600)
+    t = time.perf_counter() - t
+    print(f'{"verify_mastodon_ids":38} {n_checked / t:8.0f} probes/s   ({n_checked} accounts in {t:.2f} s)')
+
+    hosts = fediverse.hosts()
+    for module in ('retrieve_instance_info', 'test_instances'):
+        try:
+            m = __import__(module)
+        except ImportError as e:
+            print(f'{module + ".test_host":38} skipped ({e})')
+            continue
+        # the scripts take rows from their database: (name,) and (name, failures) respectively
+        rows = [(h,) if module == 'retrieve_instance_info' else (h, 0) for h in hosts]
+        run(module + '.test_host', n_threads, m.test_host, rows)
+
+    print(f'{fediverse.n_requests} requests served')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Measures how long ranking the instances of a results page takes (see main/ranking.py), compared to
+# the loop that used to be in views.handle_already_authorised (score every instance with math.log,
+# sort all of them, keep the first 20).
+#
+# Usage: python3 benchmarks/bench_ranking.py [number of instances]
+
+import math
+import random
+import sys
+import time
+
+import corpus
+from main import ranking
+
+class FakeInstance:
+    def __init__(self, users, active_month):
+        self.users = users
+        self.active_month = active_month
+
+def make_instances(n, seed = 42):
+    rng = random.Random(seed)
+    result = list()
+    for _ in range(n):
+        users = rng.choice([None, 0, 1]) if rng.random() < 0.05 else int(rng.paretovariate(0.8) * 10)
+        active_month = None if users is None or rng.random() < 0.1 else int(users * rng.random())
+        count = max(1, int(rng.paretovariate(1.2)))
+        result.append((FakeInstance(users, active_month), count))
+    return result
+
+def old_ranking(instances_with_counts, k = 20):
+    most_relevant_instances = list()
+    for inst, n in instances_with_counts:
+        if inst.users is None or n <= 2: continue
+        try:
+            inst.score = 1 / (2 - math.log(n / inst.users) * math.log(inst.users)) * 1000
+        except:
+            continue
+        most_relevant_instances.append(inst)
+    most_relevant_instances.sort(key = (lambda inst: inst.score), reverse = True)
+    return most_relevant_instances[:k]
+
+# median of the running times (the minimum of a few runs is too noisy to tell the variants apart)
+def measure(f, repeat = 200):
+    ts = list()
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        ts.append(time.perf_counter() - t)
+    ts.sort()
+    return ts[len(ts) // 2]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    instances = make_instances(n)
+    print(f'{n} instances')
+
+    old = old_ranking(instances)
+    new = ranking.rank_instances(instances)
+    assert [id(i) for i in old] == [id(i) for i in new], 'rankings differ'
+
+    t = measure(lambda: old_ranking(instances))
+    print(f'  old loop:                 {t*1000:8.2f} ms')
+    for strategy in ranking.strategies:
+        t = measure(lambda: ranking.rank_instances(instances, strategy = strategy))
+        print(f'  rank_instances {strategy + ":":18s}{t*1000:8.2f} ms')
+
+if __name__ == '__main__':
+    main()
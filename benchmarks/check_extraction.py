@@ -0,0 +1,92 @@
+# Differential check of MastodonIdExtractor.extract_from_user against the original multi-pass
+# implementation (every regex and the URL extractor run on every field), on the synthetic corpus
+# plus randomly generated profiles made up of fragments that are likely to confuse the scanner.
+#
+# Usage: python3 benchmarks/check_extraction.py [number of users]
+
+import sys
+import random
+import tweepy
+
+import corpus
+from main import extract_mastodon_ids as e
+
+# This is the extraction as it was done before the single-pass scanner was introduced.
+def reference_extract_from_user(extractor, u, pinned_tweets, src = None):
+    uid = u.id
+    name = u.name
+    location = u.location
+    screenname = u.username
+    bio = u.description
+    pinned_tweet = None
+    pinned_tweet_text = ""
+    if u.pinned_tweet_id is not None:
+        pinned_tweet = pinned_tweets.get(u.pinned_tweet_id)
+        if pinned_tweet is not None: pinned_tweet_text = pinned_tweet.text
+    extras = None
+    mastodon_ids = set()
+    strict_validator = extractor.strict_validator
+    for text in [name, location, bio, pinned_tweet_text]:
+        if text is None: continue
+        for prefix, s in e._id_pattern1.findall(text):
+            mid = extractor.parse_mastodon_id(s, certain = bool(prefix))
+            if mid is not None: mastodon_ids.add(mid)
+    for url in e.extract_urls_from_user(u) + e.extract_urls_from_tweet(pinned_tweet):
+        mid = e.mk_mastodon_id_from_url(strict_validator, url)
+        if mid is not None: mastodon_ids.add(mid)
+    for s in (name, location, bio, pinned_tweet_text):
+        if s is None: continue
+        for entire_match, _, h_str, _, u_str in e._id_pattern2.findall(s):
+            mid = strict_validator.make_mastodon_id(u_str, h_str, original = entire_match)
+            if mid is not None: mastodon_ids.add(mid)
+    for s in (name, location, bio, pinned_tweet_text):
+        if s is None: continue
+        for url in extractor.url_extractor.find_urls(s):
+            mid = e.mk_mastodon_id_from_url(strict_validator, url)
+            if mid is not None: mastodon_ids.add(mid)
+    mastodon_ids = sorted(mastodon_ids, key = str)
+    if not mastodon_ids:
+        extras = [d for d in u.description.splitlines() if e._keyword_pattern.match(d)] or None
+    return e.UserResult(uid, src, name, screenname, bio, mastodon_ids, extras)
+
+_fragments = [
+    '@', '/', '/@', '/web/', '/WEB/@', 'web/', 'https://', 'http://', '.', ',', ':', ' ', '\n', '(', ')', '🐘', 'Mastodon:',
+    'mastodon', 'MASTODON', 'toot', 'TRÖT', 'tröt', 'fedi', 'maſtodon', 'foo', 'bar_1', 'x-y', 'mastodon.social', 'mas.to',
+    'graz.social', 'example.com', 'gmail.com', 'medium.com', 'social', 'masto', 'de', 'co.uk', '.social', '..', '@@',
+    'users/', 'u/', '#', '?', '!', '…', 'ℹ️', ' ', '\t']
+
+def random_text(rng):
+    return ''.join(rng.choice(_fragments) for _ in range(rng.randint(0, 25)))
+
+def random_user(rng, i):
+    entities = {}
+    if rng.random() < 0.2:
+        entities['description'] = {'urls': [{'expanded_url': random_text(rng)}]}
+    return tweepy.User({
+        'id': str(i), 'name': random_text(rng), 'username': f'u{i}', 'location': random_text(rng),
+        'description': random_text(rng), 'entities': entities})
+
+def describe(r):
+    return ([(str(mid), mid.original) for mid in r.mastodon_ids], r.extras)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(1)
+    users = corpus.make_users(n) + [random_user(rng, i) for i in range(n)]
+    # a known host callback that accepts some hosts that the heuristic does not accept
+    extractor = e.MastodonIdExtractor(lambda s: 'o' in s)
+    mismatches = 0
+    for u in users:
+        expected = describe(reference_extract_from_user(extractor, u, {}))
+        actual = describe(extractor.extract_from_user(u, {}))
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 10:
+                print('Mismatch for', repr((u.name, u.location, u.description)))
+                print('  expected:', expected)
+                print('  actual:  ', actual)
+    print(f'{len(users)} users checked, {mismatches} mismatches')
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Generates a synthetic corpus of Twitter profiles for the benchmarks in this directory.
+# The profiles are tweepy.User objects that look roughly like what the Twitter API returns for
+# a follower list: most bios contain nothing of interest, some mention Mastodon-related keywords
+# and some contain a Mastodon ID in one of the many forms that we recognise.
+
+import os
+import sys
+import random
+import tweepy
+
+# make the 'main' package importable when running a benchmark from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_hosts = [
+    'mastodon.social', 'mas.to', 'mstdn.social', 'fosstodon.org', 'hachyderm.io', 'graz.social', 'chaos.social',
+    'infosec.exchange', 'mathstodon.xyz', 'sigmoid.social', 'det.social', 'mastodon.online', 'toot.community',
+    'kolektiva.social', 'scholar.social', 'mastodon.gamedev.place', 'tech.lgbt', 'universeodon.com']
+
+_other_hosts = ['gmail.com', 'example.org', 'github.com', 'linktr.ee', 'youtube.com', 'medium.com']
+
+_words = [
+    'coffee', 'cats', 'science', 'software', 'developer', 'writer', 'opinions', 'my', 'own', 'he/him', 'she/her',
+    'they/them', 'research', 'PhD', 'student', 'music', 'photography', 'climate', 'open', 'source', 'Berlin',
+    'London', 'gamer', 'artist', 'dad', 'mum', 'teacher', 'maths', 'python', 'rust', 'tea', '🌈', '🏳️‍⚧️', 'ℹ️']
+
+def _user_name(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz_0123456789') for _ in range(rng.randint(4, 12)))
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(_words) for _ in range(n))
+
+def _mastodon_id(rng):
+    user = _user_name(rng)
+    host = rng.choice(_hosts)
+    form = rng.randrange(6)
+    if form == 0: return f'@{user}@{host}'
+    if form == 1: return f'{user}@{host}'
+    if form == 2: return f'🐘 {user}@{host}'
+    if form == 3: return f'Mastodon: {user}@{host}'
+    if form == 4: return f'https://{host}/@{user}'
+    return f'{host}/web/@{user}'
+
+def make_user(rng, i):
+    name = _sentence(rng, rng.randint(1, 3))
+    location = rng.choice(['', 'Berlin', 'London', 'Graz, Austria', 'The Internet', 'he/him'])
+    bio_lines = [_sentence(rng, rng.randint(3, 20)) for _ in range(rng.randint(1, 3))]
+    entities = {}
+    r = rng.random()
+    if r < 0.08:
+        mid = _mastodon_id(rng)
+        if rng.random() < 0.3:
+            name = name + ' ' + mid
+        else:
+            bio_lines.insert(rng.randrange(len(bio_lines) + 1), mid)
+    elif r < 0.12:
+        bio_lines.append(rng.choice(['Also on Mastodon', 'find me on the fediverse', 'toot toot', 'trötet auch']))
+    elif r < 0.2:
+        bio_lines.append(f'mail: {_user_name(rng)}@{rng.choice(_other_hosts)}')
+    if rng.random() < 0.3:
+        url = f'https://{rng.choice(_other_hosts)}/{_user_name(rng)}'
+        entities['url'] = {'urls': [{'url': 'https://t.co/abc', 'expanded_url': url}]}
+    if rng.random() < 0.02:
+        url = f'https://{rng.choice(_hosts)}/@{_user_name(rng)}'
+        entities['description'] = {'urls': [{'url': 'https://t.co/def', 'expanded_url': url}]}
+    data = {
+        'id': str(1000000 + i),
+        'name': name,
+        'username': _user_name(rng),
+        'location': location,
+        'description': '\n'.join(bio_lines),
+        'entities': entities}
+    if rng.random() < 0.05:
+        data['pinned_tweet_id'] = str(2000000 + i)
+    return tweepy.User(data)
+
+# The pinned tweet of a user (if it has one); some of them mention a Mastodon ID
+def make_pinned_tweet(u):
+    rng = random.Random(u.pinned_tweet_id)
+    text = _sentence(rng, rng.randint(3, 30))
+    entities = {}
+    if rng.random() < 0.3:
+        text = text + ' I am now on Mastodon: ' + _mastodon_id(rng)
+    elif rng.random() < 0.1:
+        entities['urls'] = [{'url': 'https://t.co/ghi', 'expanded_url': f'https://{rng.choice(_hosts)}/@{_user_name(rng)}'}]
+    return tweepy.Tweet({'id': str(u.pinned_tweet_id), 'text': text, 'entities': entities, 'edit_history_tweet_ids': [str(u.pinned_tweet_id)]})
+
+def make_users(n, seed = 42, offset = 0):
+    rng = random.Random(seed)
+    return [make_user(rng, i) for i in range(offset, offset + n)]
+
+# Splits the users into tweepy.Response objects of the given page size, like the ones returned by
+# e.g. Client.get_users_following
+def make_pages(users, page_size = 1000):
+    pages = list()
+    for i in range(0, len(users), page_size):
+        us = users[i:i + page_size]
+        tweets = [make_pinned_tweet(u) for u in us if u.pinned_tweet_id is not None]
+        pages.append(tweepy.Response(data = us, includes = {'tweets': tweets}, errors = [], meta = {}))
+    return pages
@@ -0,0 +1,177 @@
+# A local stand-in for a large number of Fediverse servers, for benchmarking the code that talks to
+# them (webfinger, host-meta, nodeinfo) without touching the network.
+#
+# One HTTPS server (see local_tls) answers for all virtual hosts host0.fedi.test, host1.fedi.test, ...;
+# install_resolver makes these names resolve to it (for any port) within the benchmark process. The
+# server runs in a process of its own, so that it does not compete with the benchmark for the GIL.
+# Every virtual host behaves consistently (same seed, same answers), roughly like this:
+#   - dead_rate of the hosts close every connection without answering
+#   - error_rate of the requests get a 503
+#   - malformed_rate of the answers are garbage instead of XML/JSON
+#   - hostmeta_rate of the hosts have a host-meta (with a non-standard webfinger path), the others 404
+#   - missing_rate of the accounts do not exist (404 on webfinger)
+#   - every answer is delayed by latency seconds (exponentially distributed around that mean)
+#
+# Usage on its own: python3 benchmarks/fake_fediverse.py [number of hosts]
+
+import json
+import multiprocessing
+import random
+import socket
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import local_tls
+
+domain = '.fedi.test'
+
+class FakeFediverse:
+    def __init__(self, n_hosts = 2000, latency = 0.0, error_rate = 0.0, dead_rate = 0.0, malformed_rate = 0.0,
+            hostmeta_rate = 0.5, missing_rate = 0.1, seed = 42):
+        self.n_hosts = n_hosts
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dead_rate = dead_rate
+        self.malformed_rate = malformed_rate
+        self.hostmeta_rate = hostmeta_rate
+        self.missing_rate = missing_rate
+        self.seed = seed
+        self.port = None
+        self.base_url = None
+        self.certificate = None
+        self._n_requests = multiprocessing.Value('l', 0)
+        self._process = None
+
+    def hosts(self):
+        return [f'host{i}{domain}' for i in range(self.n_hosts)]
+
+    # a number in [0, 1) that only depends on the seed and the given strings
+    def _hash(self, *xs):
+        return zlib.crc32('\0'.join((str(self.seed),) + xs).encode()) / 2**32
+
+    def is_dead(self, host):
+        return self._hash('dead', host) < self.dead_rate
+
+    def has_hostmeta(self, host):
+        return self._hash('hostmeta', host) < self.hostmeta_rate
+
+    def account_exists(self, user, host):
+        return self._hash('account', user, host) >= self.missing_rate
+
+    @property
+    def n_requests(self):
+        return self._n_requests.value
+
+    def start(self):
+        conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target = self._serve, args = (child_conn,), daemon = True)
+        self._process.start()
+        self.port, self.base_url, self.certificate = conn.recv()
+        return self
+
+    def _serve(self, conn):
+        class Handler(FakeFediverseHandler):
+            fediverse = self
+        server = local_tls.serve(Handler)
+        conn.send((server.server_address[1], server.base_url, server.certificate))
+        while True: time.sleep(3600)
+
+    # Makes all virtual hosts resolve to the server in this process, and makes the shared HTTP client
+    # trust the server's certificate
+    def install_resolver(self):
+        port = self.port
+        original = socket.getaddrinfo
+        def getaddrinfo(host, p, *args, **kwargs):
+            if isinstance(host, str) and host.endswith(domain):
+                return original('127.0.0.1', port, *args, **kwargs)
+            return original(host, p, *args, **kwargs)
+        socket.getaddrinfo = getaddrinfo
+        from main import http_client
+        s = http_client.session()
+        s.verify = self.certificate
+        s.trust_env = False # otherwise REQUESTS_CA_BUNDLE etc. take precedence over verify
+
+class FakeFediverseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # headers and body are written separately
+    fediverse = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(head = True)
+
+    def do_GET(self):
+        self.handle_request(head = False)
+
+    def send(self, status, content_type = 'application/json', body = b'', head = False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head: self.wfile.write(body)
+
+    def handle_request(self, head):
+        f = self.fediverse
+        with f._n_requests.get_lock():
+            f._n_requests.value += 1
+        host = (self.headers.get('Host') or '').split(':')[0].lower()
+        url = urlsplit(self.path)
+        if f.is_dead(host):
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if f.latency > 0:
+            time.sleep(random.expovariate(1 / f.latency))
+        if random.random() < f.error_rate:
+            self.send(503, 'text/plain', b'Service Unavailable', head)
+            return
+        if random.random() < f.malformed_rate:
+            self.send(200, 'application/json', b'<html>{"links": [', head)
+            return
+
+        if url.path == '/.well-known/host-meta':
+            if not f.has_hostmeta(host):
+                self.send(404, 'text/plain', b'Not Found', head)
+                return
+            body = ('<?xml version="1.0" encoding="UTF-8"?>\n<XRD xmlns="http://docs.oasis-open.org/ns/xri/xrd-1.0">'
+                f'<Link rel="lrdd" template="https://{host}/.well-known/webfinger-alt?resource={{uri}}"/></XRD>')
+            self.send(200, 'application/xrd+xml', body.encode(), head)
+        elif url.path in ('/.well-known/webfinger', '/.well-known/webfinger-alt'):
+            resource = parse_qs(url.query).get('resource', [''])[0]
+            if resource.startswith('acct:'): resource = resource[5:]
+            user, _, h = resource.partition('@')
+            if h != host or not f.account_exists(user, host):
+                self.send(404, 'application/json', b'', head)
+                return
+            body = {'subject': f'acct:{user}@{host}', 'links': [
+                {'rel': 'self', 'type': 'application/activity+json', 'href': f'https://{host}/users/{user}'},
+                {'rel': 'http://webfinger.net/rel/profile-page', 'type': 'text/html', 'href': f'https://{host}/@{user}'}]}
+            self.send(200, 'application/jrd+json', json.dumps(body).encode(), head)
+        elif url.path == '/.well-known/nodeinfo':
+            body = {'links': [{'rel': 'http://nodeinfo.diaspora.software/ns/schema/2.0', 'href': f'https://{host}/nodeinfo/2.0'}]}
+            self.send(200, 'application/json', json.dumps(body).encode(), head)
+        elif url.path == '/nodeinfo/2.0':
+            users = int(f._hash('users', host) * 100000)
+            body = {'version': '2.0', 'software': {'name': 'mastodon', 'version': '4.0.2'}, 'protocols': ['activitypub'],
+                'openRegistrations': f._hash('open', host) < 0.5,
+                'usage': {'users': {'total': users, 'activeMonth': users // 5, 'activeHalfyear': users // 3}, 'localPosts': users * 40}}
+            self.send(200, 'application/json', json.dumps(body).encode(), head)
+        else:
+            self.send(404, 'text/plain', b'Not Found', head)
+
+def main():
+    n_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    f = FakeFediverse(n_hosts = n_hosts).start()
+    print(f'Serving {n_hosts} virtual hosts (host0{domain} ...) on {f.base_url}; press Ctrl-C to stop')
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
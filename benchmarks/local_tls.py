@@ -0,0 +1,67 @@
+# A local HTTPS server (with a throwaway self-signed certificate) for benchmarks of the HTTP client.
+# Needs the openssl command line tool.
+
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# The certificate is valid for 127.0.0.1, localhost and *.fedi.test (see fake_fediverse); clients can
+# trust it by passing its path as verify.
+def make_certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost,DNS:*.fedi.test,IP:127.0.0.1',
+        '-keyout', key, '-out', cert], check = True, capture_output = True)
+    return cert, key
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    # clients that go away (and servers that hang up on purpose) are nothing to report here
+    def handle_error(self, request, client_address):
+        pass
+
+# Starts serving with the given handler class (which should set protocol_version = 'HTTP/1.1' so that
+# connections are kept alive) on a free port in a background thread. Returns the server; its base
+# URL is server.base_url, and the path of its certificate server.certificate (which lives as long as
+# the process).
+def serve(handler_class, tls = True):
+    server = _Server(('127.0.0.1', 0), handler_class)
+    scheme = 'http'
+    server.certificate = None
+    if tls:
+        cert, key = make_certificate(tempfile.mkdtemp())
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side = True)
+        server.certificate = cert
+        scheme = 'https'
+    server.base_url = f'{scheme}://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+class WebfingerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # headers and body are written separately
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/jrd+json')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        body = b'{"subject": "acct:someone@localhost", "links": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/jrd+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
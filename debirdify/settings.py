@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os
+import stat
 from ast import literal_eval
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +55,16 @@ if len(TWITTER_CONSUMER_CREDENTIALS) != 2:
 TWITTER_CREDENTIALS_COOKIE = env('DEBIRDIFY_ACCESS_CREDENTIALS_COOKIE', 'twitter_access_credentials')
 #INSTANCE_DB = env('DEBIRDIFY_INSTANCE_DB', default = BASE_DIR / "db.sqlite3")
 INSTANCE_DB_PASSWORD = env('DEBIRDIFY_INSTANCE_DB_PASSWORD')
+# number of processes per worker used to extract Mastodon IDs from large pages of users (0: none)
+EXTRACTION_WORKERS = int(env('DEBIRDIFY_EXTRACTION_WORKERS', '0'))
+# number of the biggest instances whose webfinger templates are fetched when a worker starts
+WEBFINGER_PREWARM_HOSTS = int(env('DEBIRDIFY_WEBFINGER_PREWARM_HOSTS', '100'))
+# max. number of profile page URLs that are looked up in the background after a search (0: none)
+PRERESOLVE_PROFILE_URLS = int(env('DEBIRDIFY_PRERESOLVE_PROFILE_URLS', '0'))
+# how the 'most relevant instances' are ranked (see main/ranking.py: relevance, active, activity_weighted, accounts)
+INSTANCE_RANKING = env('DEBIRDIFY_INSTANCE_RANKING', 'relevance')
+# how long (in seconds) the results of a search are kept on the server for reloads and downloads (0: not at all)
+RESULT_CACHE_TTL = int(env('DEBIRDIFY_RESULT_CACHE_TTL', '600'))
 
 # Application definition
 
@@ -114,6 +126,36 @@ DATABASES = {
 }
 
 
+# Cache for the results of searches (see main/result_cache.py). It has to be shared by all worker
+# processes, since the browser comes back for the results (downloads, further pages of the instance
+# list) in separate requests; the default is the directory 'result_cache' next to this project. With
+# an in-memory cache, the results page contains all of the results again.
+RESULT_CACHE_BACKEND = env('DEBIRDIFY_RESULT_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+RESULT_CACHE_LOCATION = env('DEBIRDIFY_RESULT_CACHE_LOCATION', str(BASE_DIR / 'result_cache'))
+
+# The file-based cache unpickles whatever files are in its directory, so no one else may be able to
+# put files there (or read the results of other users)
+def check_private_directory(path):
+    os.makedirs(path, mode = 0o700, exist_ok = True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise ImproperlyConfigured(f'The result cache directory {path} must be a directory that belongs to this user and is not accessible to anyone else (mode 0700)')
+
+if RESULT_CACHE_BACKEND == 'django.core.cache.backends.filebased.FileBasedCache':
+    check_private_directory(RESULT_CACHE_LOCATION)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "results": {
+        "BACKEND": RESULT_CACHE_BACKEND,
+        "LOCATION": RESULT_CACHE_LOCATION,
+        "TIMEOUT": RESULT_CACHE_TTL,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
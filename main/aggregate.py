@@ -0,0 +1,119 @@
+import threading
+
+from .instance import get_instances
+from . import ranking
+
+# Everything the results page shows about the users found in a search apart from the users themselves:
+# the Mastodon IDs grouped by instance (with the index of every instance in that list), the number of
+# IDs per Fediverse software and the most relevant instances.
+#
+# Users are added one at a time with add, so sources that produce their results page by page can keep
+# the aggregates current without going over all users again. The per-instance data (Instance objects,
+# sorting, software statistics, ranking) is only computed when it is read, and only needs one pass
+# over the instances; the Instance objects of hosts that were already looked up are reused.
+# The views keep aggregators around and read them from several requests at once, hence the lock.
+class ResultAggregator:
+    def __init__(self, n_most_relevant = 20, ranking_strategy = 'relevance'):
+        self.n_most_relevant = n_most_relevant
+        self.ranking_strategy = ranking_strategy
+        self.n_users_found = 0 # users with at least one Mastodon ID
+        self.n_accounts_found = 0 # Mastodon IDs
+        self._by_host = dict() # host -> list of (user, Mastodon ID)
+        self._instances = dict() # host -> Instance
+        self._summary = None
+        self._lock = threading.Lock()
+
+    def add(self, u):
+        if not u.mastodon_ids: return
+        with self._lock:
+            self._summary = None
+            self.n_users_found += 1
+            self.n_accounts_found += len(u.mastodon_ids)
+            by_host = self._by_host
+            for mid in u.mastodon_ids:
+                us = by_host.get(mid.host_part)
+                if us is None:
+                    by_host[mid.host_part] = [(u, mid)]
+                else:
+                    us.append((u, mid))
+
+    def add_all(self, users):
+        for u in users:
+            self.add(u)
+
+    def _update(self):
+        with self._lock:
+            if self._summary is None:
+                self._summary = self._compute()
+            return self._summary
+
+    # called with the lock held
+    def _compute(self):
+        missing = [host for host in self._by_host if host not in self._instances]
+        if missing:
+            self._instances.update(get_instances(missing))
+
+        by_instance = list()
+        service_stats = dict()
+        for host, us in self._by_host.items():
+            inst = self._instances[host]
+            # left over from an earlier ranking
+            inst.__dict__.pop('score', None)
+            inst.__dict__.pop('rel_score', None)
+            by_instance.append((inst, us))
+            software = 'Unknown' if inst.software is None else inst.software.title()
+            service_stats[software] = service_stats.get(software, 0) + len(us)
+
+        by_instance.sort(key = lambda x: x[0].compare_key(x[1]))
+        for i, (inst, _) in enumerate(by_instance):
+            inst.index = i
+            inst.index_plus_one = i + 1
+
+        def service_key(x):
+            if x[0] == 'Unknown':
+                return 1
+            else:
+                return -int(x[1])
+        service_stats = sorted(service_stats.items(), key = service_key)
+
+        most_relevant = ranking.rank_instances([(inst, len(us)) for inst, us in by_instance],
+            k = self.n_most_relevant, strategy = self.ranking_strategy)
+        if len(most_relevant) <= 1: most_relevant = None
+        if most_relevant:
+            max_score = max([inst.score for inst in most_relevant])
+            for inst in most_relevant:
+                inst.rel_score = inst.score / max_score * 100
+        else:
+            max_score = 0.0
+
+        return (by_instance, service_stats, most_relevant, max_score)
+
+    # List of pairs (Instance, list of (user, Mastodon ID)), in the order in which the results page shows them
+    @property
+    def mastodon_ids_by_instance(self):
+        return self._update()[0]
+
+    # List of pairs (software name, number of Mastodon IDs), the most common first and 'Unknown' last
+    @property
+    def service_stats(self):
+        return self._update()[1]
+
+    # The instances with the highest ranking score (None if there are fewer than two)
+    @property
+    def most_relevant_instances(self):
+        return self._update()[2]
+
+    @property
+    def max_score(self):
+        return self._update()[3]
+
+    # The entries of the template context of the results page that are computed here
+    def context(self):
+        by_instance, service_stats, most_relevant, max_score = self._update()
+        return {
+            'n_accounts_found': self.n_accounts_found,
+            'mastodon_ids_by_instance': by_instance,
+            'service_stats': service_stats,
+            'max_score': max_score,
+            'most_relevant_instances': most_relevant,
+        }
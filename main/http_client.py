@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# The HTTP client used for all requests to Fediverse servers (webfinger, host-meta, nodeinfo). All
+# requests of a process go through one session, so connections to the same host are kept alive and
+# reused instead of doing a new TCP and TLS handshake every time.
+# This module does not depend on Django, so the scripts that refresh the instance database use it as well.
+
+# Timeouts (connect, read) in seconds for the different kinds of requests. For hosts whose latency
+# we know (see HostHealth), shorter timeouts are used; these are only the upper bounds.
+timeouts = {
+    'webfinger': (2, 2),
+    'host-meta': (3, 5),
+    'profile': (3, 5),
+    'nodeinfo': (5, 10),
+}
+default_timeout = (5, 5)
+
+# Timeouts derived from the observed latency of a host are latency_factor times its 95th percentile
+# latency, but at least min_timeout seconds; they are only used once we have min_samples latencies.
+latency_factor = 4
+min_timeout = 1
+min_samples = 5
+
+# After failure_threshold failures in a row (no answer or a server error), requests to a host fail
+# right away for open_duration seconds; after that, one request is let through, and if it fails as
+# well, the host is blocked for twice as long as before (at most max_open_duration seconds).
+failure_threshold = 3
+open_duration = 60
+max_open_duration = 3600
+
+# Number of hosts for which a connection pool is kept, and max. number of idle connections kept per host
+pool_connections = 256
+pool_maxsize = 8
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+def make_session():
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+# The session is created on first use in every process (sockets must not be shared with a forked
+# process, e.g. a uWSGI worker that was forked after the app was loaded)
+def session():
+    global _session, _session_pid
+    s = _session
+    if s is not None and _session_pid == os.getpid(): return s
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = make_session()
+            _session_pid = os.getpid()
+        return _session
+
+# Raised instead of making a request to a host that has failed too often recently
+class HostUnavailable(requests.exceptions.ConnectionError):
+    pass
+
+# Latency and failures of the requests to one host
+class HostHealth:
+    def __init__(self):
+        self.latencies = deque(maxlen = 32)
+        self.failures = 0 # failures in a row
+        self.open_until = None # requests fail right away until then (if not None)
+        self.open_duration = open_duration
+        self.trial = False # whether the request that is let through after open_until is running
+
+    def percentile(self, p):
+        if not self.latencies: return None
+        xs = sorted(self.latencies)
+        return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+# Tracks the HostHealth of every host we send requests to (up to max_hosts of them; the ones we have
+# not heard of the longest are dropped first). Hosts are given as 'name:port' (see host_key).
+class HealthTracker:
+    def __init__(self, max_hosts = 10000):
+        self.max_hosts = max_hosts
+        self._hosts = dict()
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        return self._hosts.get(host)
+
+    def _get(self, host):
+        h = self._hosts.pop(host, None)
+        if h is None:
+            h = HostHealth()
+            if len(self._hosts) >= self.max_hosts:
+                del self._hosts[next(iter(self._hosts))]
+        self._hosts[host] = h
+        return h
+
+    # Raises HostUnavailable if no request should be sent to the host right now
+    def before_request(self, host):
+        h = self._hosts.get(host)
+        if h is None or h.open_until is None: return
+        with self._lock:
+            if h.open_until is None: return
+            if time.monotonic() < h.open_until or h.trial:
+                raise HostUnavailable(f'{host} has failed too often recently')
+            h.trial = True
+
+    def record_success(self, host, latency):
+        with self._lock:
+            h = self._get(host)
+            h.latencies.append(latency)
+            h.failures = 0
+            h.open_until = None
+            h.open_duration = open_duration
+            h.trial = False
+
+    def record_failure(self, host):
+        with self._lock:
+            h = self._get(host)
+            h.failures += 1
+            if h.trial:
+                h.open_duration = min(h.open_duration * 2, max_open_duration)
+                h.trial = False
+                h.open_until = time.monotonic() + h.open_duration
+            elif h.failures >= failure_threshold and h.open_until is None:
+                h.open_until = time.monotonic() + h.open_duration
+
+    # The (connect, read) timeout for a request of the given kind to the host
+    def timeout(self, host, kind = None):
+        connect, read = timeouts.get(kind, default_timeout)
+        h = self._hosts.get(host)
+        if h is None or len(h.latencies) < min_samples: return (connect, read)
+        t = max(min_timeout, latency_factor * h.percentile(0.95))
+        return (min(connect, t), min(read, t))
+
+health = HealthTracker()
+
+# Hosts are told apart by name and port, so that failures on some port of a host do not block the
+# requests to the host's web server
+def host_key(url):
+    parts = urlsplit(url)
+    port = parts.port or (80 if parts.scheme == 'http' else 443)
+    return f'{parts.hostname}:{port}'
+
+def request(method, url, kind = None, **kwargs):
+    host = host_key(url)
+    if 'timeout' not in kwargs: kwargs['timeout'] = health.timeout(host, kind)
+    kwargs.setdefault('allow_redirects', True)
+    health.before_request(host)
+    t = time.monotonic()
+    try:
+        resp = session().request(method, url, **kwargs)
+    except Exception:
+        health.record_failure(host)
+        raise
+    if resp.status_code >= 500:
+        health.record_failure(host)
+    else:
+        health.record_success(host, time.monotonic() - t)
+    return resp
+
+def get(url, kind = None, **kwargs):
+    return request('GET', url, kind = kind, **kwargs)
+
+def head(url, kind = None, **kwargs):
+    return request('HEAD', url, kind = kind, **kwargs)
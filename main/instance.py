@@ -1,33 +1,16 @@
-from django.db import connection
-import pycountry
-
-logos = {
-    'aardwolf': 'aardwolf.png', 'bonfire': 'bonfire.png', 'bookwyrm': 'bookwyrm.png', 'calckey': 'calckey.png', 'castopod': 'castopod.svg',
-    'diaspora': 'diaspora.svg', 'dokieli': 'dokieli.png', 'drupal': 'drupal.svg', 'epicyon': 'epicyon.png', 'forgefriends': 'forgefriends.svg',
-    'friendica': 'friendica.svg', 'funkwhale': 'funkwhale.svg', 'gancio': 'gancio.png', 'gnusocial': 'gnusocial.svg', 
-    'gotosocial': 'gotosocial.png', 'guppe': 'guppe.png', 'kbin': 'kbin.png', 'ktistec': 'ktistec.png', 'lemmy': 'lemmy.svg', 
-    'mastodon': 'mastodon.svg', 'minipub': 'minipub.svg', 'misskey': 'misskey.png', 'misty': 'misty.png', 'mobilizon': 'mobilizon.svg',
-    'nextcloud': 'nextcloud.png', 'ocelot': 'ocelot.svg', 'osada': 'osada.png', 'owncast': 'owncast.svg', 'peertube': 'peertube.svg', 
-    'pixelfed': 'pixelfed.svg', 'pleroma': 'pleroma.svg', 'plume': 'plume.svg', 'readas': 'readas.svg', 'redmatrix': 'redmatrix.png', 
-    'roadhouse': 'roadhouse.png', 'socialhome': 'socialhome.svg', 'wordpress': 'wordpress.svg', 'writefreely': 'writefreely.svg', 
-    'zap': 'zap.png'}
-
-def mk_int(x):
-    if x is None: return None
-    try:
-        return int(x)
-    except:
-        return None
-
-def mk_bool(x):
-    if x is None: return None
-    if isinstance(x, bool): return x
-    if x in (1, True, '1', 'true', 'True'): return True
-    if x in (0, False, '0', 'false', 'False'): return False
-    return None
+from django.db import connection, ProgrammingError
+from django.conf import settings
+import copy
+import select
+import threading
+import time
+import psycopg2
+from .instance_display import logos, mk_int, mk_bool, Country, display_columns, display_fields
 
 class Instance:
-    def __init__(self, host, local_domain, software, software_version, registrations_open, users, active_month, active_halfyear, local_posts, last_update, uptime, country_code, dead, up):
+    # display: the display fields in the order of display_columns, as stored by the refresh scripts;
+    # if they are not given, they are computed here
+    def __init__(self, host, local_domain, software, software_version, registrations_open, users, active_month, active_halfyear, local_posts, last_update, uptime, country_code, dead, up, display = None):
         host = host.lower()
         self.host = host
         if local_domain is None:
@@ -47,43 +30,12 @@ class Instance:
         self.dead = dead
         self.up = up
         self.last_update = last_update
-        self.uptime = None
-        if uptime is not None:
-            uptime = uptime / 100
-            try:
-                if uptime == 1.0:
-                    self.uptime = '100 %'
-                elif uptime >= 0.9998:
-                    self.uptime = '%.3f %%' % (float(uptime)*100)
-                elif uptime >= 0.998:
-                    self.uptime = '%.2f %%' % (float(uptime)*100)
-                elif uptime >= 0.98:
-                    self.uptime = '%.1f %%' % (float(uptime)*100)
-                else:
-                    self.uptime = '%.0f %%' % (float(uptime)*100)
-            except:
-                pass
-        self.icon = logos.get(self.software)
         self.webfinger_url = f'https://{self.local_domain}/.well-known/webfinger'
-        
-        if country_code is not None:
-            self.country = pycountry.countries.get(alpha_2 = country_code)
-        
-        stats = None
-        if self.users is not None:
-            stats = f'users: {self.users}'
-            tmp = list()
-            for x, y in [('active_month', 'last month'), ('active_halfyear', 'last 6 months'), ('uptime', 'uptime')]:
-                z = getattr(self, x)
-                if z is None: continue
-                tmp.append(f'{y}: {z}')
-            if tmp: stats = stats + ' (' + '; '.join(tmp) + ')'
-        self.stats = stats
-            
-        if self.last_update is not None:
-            self.last_update_pretty = self.last_update.strftime('%-d %B %Y, %H:%M')
-        else:
-            self.last_update_pretty = None
+
+        if display is None:
+            display = display_fields(software, users, active_month, active_halfyear, uptime, country_code, last_update)
+        self.icon, self.uptime, self.stats, self.last_update_pretty, country_name, country_flag = display
+        self.country = Country(country_name, country_flag) if country_name is not None else None
             
     def compare_key(self, us):
         if self.software == 'mastodon':
@@ -110,15 +62,138 @@ class Instance:
 def naked_instance(name):
     return Instance(name.lower(), None, None, None, None, None, None, None, None, None, None, None, None, None)
 
+_columns = 'name, local_domain, software, software_version, registrations_open, users, active_month, active_halfyear, local_posts, last_update, uptime, country_code, dead, up'
+
+# Instance metadata only changes when the refresh scripts run, so Instances are cached across requests
+# by every worker for up to ttl seconds (at most max_entries of them; the oldest ones are dropped first).
+# The refresh scripts send a NOTIFY on the channel 'instances_changed' after every update; a background
+# thread listens for it on a connection of its own and empties the cache, so that no worker shows stale
+# data for long. If the listener cannot connect, it tries again every retry_interval seconds.
+class InstanceCache:
+    channel = 'instances_changed'
+
+    def __init__(self, ttl = 3600, max_entries = 20000, retry_interval = 60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.retry_interval = retry_interval
+        self._entries = dict() # name -> (Instance, time it was loaded)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_invalidation = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns a dict that maps those of the given names that are in the cache to a copy of their
+    # Instance (the views attach things like scores to them)
+    def get_many(self, names):
+        self.ensure_listening()
+        now = time.monotonic()
+        result = dict()
+        for name in names:
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] + self.ttl >= now:
+                result[name] = copy.copy(entry[0])
+        return result
+
+    def put_many(self, instances):
+        now = time.monotonic()
+        with self._lock:
+            for i in instances:
+                self._entries.pop(i.host, None)
+                self._entries[i.host] = (copy.copy(i), now)
+            n = len(self._entries) - self.max_entries
+            if n > 0:
+                for name in [name for name, _ in zip(self._entries, range(n))]:
+                    del self._entries[name]
+
+    def invalidate(self):
+        global _has_display_columns
+        with self._lock:
+            self._entries = dict()
+            # the refresh scripts may have added them in the meantime
+            _has_display_columns = None
+        self.last_invalidation = time.time()
+
+    def _listen(self):
+        db = settings.DATABASES['default']
+        con = psycopg2.connect(dbname = db['NAME'], user = db['USER'], password = db['PASSWORD'], host = db['HOST'] or None, port = db['PORT'] or None)
+        try:
+            con.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with con.cursor() as cur:
+                cur.execute(f'LISTEN {self.channel}')
+            # anything might have changed while we were not listening
+            self.invalidate()
+            while True:
+                select.select([con], [], [], 300)
+                con.poll()
+                if con.notifies:
+                    con.notifies.clear()
+                    self.invalidate()
+        finally:
+            con.close()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                print('Instance cache listener failed:', e)
+            time.sleep(self.retry_interval)
+
+    def ensure_listening(self):
+        if self._thread is not None: return
+        with self._lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target = self._run, daemon = True)
+            self._thread.start()
+
+instance_cache = InstanceCache()
+
+# Whether the 'instances' table has the display columns (None: not known yet); they are only there
+# once a refresh script has run (see instance_display.materialize_display_fields)
+_has_display_columns = None
+
+def _load_rows(names):
+    global _has_display_columns
+    if _has_display_columns is not False:
+        try:
+            with connection.cursor() as cur:
+                cur.execute(f'SELECT {_columns}, {", ".join(display_columns)} FROM instances WHERE name = ANY(%s)', [names])
+                rows = cur.fetchall()
+            _has_display_columns = True
+            return rows
+        except ProgrammingError:
+            if _has_display_columns: raise
+            _has_display_columns = False
+    with connection.cursor() as cur:
+        cur.execute(f'SELECT {_columns} FROM instances WHERE name = ANY(%s)', [names])
+        return cur.fetchall()
+
 def get_instance(name):
+    return get_instances([name])[name.lower()]
+
+# Like get_instance, but for many instances at once (with a single query for all instances that are
+# not in instance_cache). Returns a dict that maps every one of the given names (in lower case) to its
+# Instance.
+def get_instances(names):
+    names = {name.lower() for name in names}
+    result = instance_cache.get_many(names)
+    missing = names.difference(result)
+    if not missing: return result
+    loaded = dict()
     try:
-        with connection.cursor() as cur:
-            cur.execute('SELECT name, local_domain, software, software_version, registrations_open, users, active_month, active_halfyear, local_posts, last_update, uptime, country_code, dead, up FROM instances WHERE name=%s LIMIT 1', [name.lower()])
-            row = cur.fetchone()
-        if row is None: return naked_instance(name)
-        i = Instance(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9], row[10], row[11], row[12], row[13])
-        return i
+        for row in _load_rows(list(missing)):
+            # rows that were added since the last refresh have no display fields yet
+            display = row[14:] if any(x is not None for x in row[14:]) else None
+            i = Instance(*row[:14], display = display)
+            if i.host in missing: loaded[i.host] = i
     except Exception as e:
         print(e)
-        return naked_instance(name)
-
+        for name in missing: result[name] = naked_instance(name)
+        return result
+    for name in missing:
+        if name not in loaded: loaded[name] = naked_instance(name)
+    instance_cache.put_many(loaded.values())
+    result.update(loaded)
+    return result
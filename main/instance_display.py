@@ -0,0 +1,112 @@
+# The fields of an Instance that are only there for displaying it (see main/instance.py). They only
+# depend on the row in the 'instances' table, so the refresh scripts compute them once for all rows
+# (see materialize_display_fields) instead of every worker doing so for every page it renders.
+# This module does not depend on Django, so that the refresh scripts can use it.
+
+from collections import namedtuple
+import pycountry
+
+logos = {
+    'aardwolf': 'aardwolf.png', 'bonfire': 'bonfire.png', 'bookwyrm': 'bookwyrm.png', 'calckey': 'calckey.png', 'castopod': 'castopod.svg',
+    'diaspora': 'diaspora.svg', 'dokieli': 'dokieli.png', 'drupal': 'drupal.svg', 'epicyon': 'epicyon.png', 'forgefriends': 'forgefriends.svg',
+    'friendica': 'friendica.svg', 'funkwhale': 'funkwhale.svg', 'gancio': 'gancio.png', 'gnusocial': 'gnusocial.svg', 
+    'gotosocial': 'gotosocial.png', 'guppe': 'guppe.png', 'kbin': 'kbin.png', 'ktistec': 'ktistec.png', 'lemmy': 'lemmy.svg', 
+    'mastodon': 'mastodon.svg', 'minipub': 'minipub.svg', 'misskey': 'misskey.png', 'misty': 'misty.png', 'mobilizon': 'mobilizon.svg',
+    'nextcloud': 'nextcloud.png', 'ocelot': 'ocelot.svg', 'osada': 'osada.png', 'owncast': 'owncast.svg', 'peertube': 'peertube.svg', 
+    'pixelfed': 'pixelfed.svg', 'pleroma': 'pleroma.svg', 'plume': 'plume.svg', 'readas': 'readas.svg', 'redmatrix': 'redmatrix.png', 
+    'roadhouse': 'roadhouse.png', 'socialhome': 'socialhome.svg', 'wordpress': 'wordpress.svg', 'writefreely': 'writefreely.svg', 
+    'zap': 'zap.png'}
+
+def mk_int(x):
+    if x is None: return None
+    try:
+        return int(x)
+    except:
+        return None
+
+def mk_bool(x):
+    if x is None: return None
+    if isinstance(x, bool): return x
+    if x in (1, True, '1', 'true', 'True'): return True
+    if x in (0, False, '0', 'false', 'False'): return False
+    return None
+
+
+# What the templates need to know about the country of an instance
+Country = namedtuple('Country', ['name', 'flag'])
+
+def format_uptime(uptime):
+    if uptime is None: return None
+    uptime = uptime / 100
+    try:
+        if uptime == 1.0:
+            return '100 %'
+        elif uptime >= 0.9998:
+            return '%.3f %%' % (float(uptime)*100)
+        elif uptime >= 0.998:
+            return '%.2f %%' % (float(uptime)*100)
+        elif uptime >= 0.98:
+            return '%.1f %%' % (float(uptime)*100)
+        else:
+            return '%.0f %%' % (float(uptime)*100)
+    except:
+        return None
+
+# The display fields, in the order of display_columns
+display_columns = ('icon', 'uptime_pretty', 'stats', 'last_update_pretty', 'country_name', 'country_flag')
+
+def display_fields(software, users, active_month, active_halfyear, uptime, country_code, last_update):
+    icon = logos.get(software.lower()) if software is not None else None
+    uptime_pretty = format_uptime(uptime)
+    users = mk_int(users)
+
+    stats = None
+    if users is not None:
+        stats = f'users: {users}'
+        tmp = list()
+        for z, y in [(mk_int(active_month), 'last month'), (mk_int(active_halfyear), 'last 6 months'), (uptime_pretty, 'uptime')]:
+            if z is None: continue
+            tmp.append(f'{y}: {z}')
+        if tmp: stats = stats + ' (' + '; '.join(tmp) + ')'
+
+    last_update_pretty = None
+    if last_update is not None and hasattr(last_update, 'strftime'):
+        last_update_pretty = last_update.strftime('%-d %B %Y, %H:%M')
+
+    country_name = None
+    country_flag = None
+    if country_code is not None:
+        country = pycountry.countries.get(alpha_2 = country_code)
+        if country is not None:
+            country_name = country.name
+            country_flag = getattr(country, 'flag', None)
+    return (icon, uptime_pretty, stats, last_update_pretty, country_name, country_flag)
+
+# Adds the display columns to the 'instances' table if they are not there yet and commits, using the
+# given psycopg2 connection. Adding a column locks the whole table, so this must not happen inside the
+# transaction of a refresh; call it right after connecting, before anything else is done.
+def ensure_display_columns(con):
+    with con.cursor() as cur:
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'instances'")
+        existing = set(row[0] for row in cur.fetchall())
+        for c in display_columns:
+            if c not in existing:
+                cur.execute(f'ALTER TABLE instances ADD COLUMN IF NOT EXISTS {c} TEXT')
+    con.commit()
+
+# Computes the display fields of all instances and stores those that changed in the 'instances'
+# table (whose columns must have been added by ensure_display_columns), using the given psycopg2
+# connection; does not commit
+def materialize_display_fields(con):
+    from psycopg2.extras import execute_values
+    with con.cursor() as cur:
+        columns = ', '.join(display_columns)
+        cur.execute(f'SELECT name, software, users, active_month, active_halfyear, uptime, country_code, last_update, {columns} FROM instances')
+        rows = list()
+        for row in cur.fetchall():
+            fields = display_fields(*row[1:8])
+            if fields != row[8:]:
+                rows.append(fields + (row[0],))
+        if not rows: return
+        assignments = ', '.join(f'{c} = v.{c}' for c in display_columns)
+        execute_values(cur, f'UPDATE instances AS i SET {assignments} FROM (VALUES %s) AS v({columns}, name) WHERE i.name = v.name', rows, page_size = 1000)
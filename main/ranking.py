@@ -0,0 +1,79 @@
+# Ranks the instances found in a search by how relevant they are to the user (see 'Most Relevant
+# Instances' on the results page). Instances are scored in one pass and only the top k are sorted.
+#
+# Scoring is plain Python on purpose: most of the time goes into reading the numbers of users off the
+# Instance objects and setting their scores, which NumPy cannot speed up. A NumPy version saved only
+# about 10% at 10000 instances and was slower below about 1000, i.e. for the few hundred instances
+# of a typical search (see benchmarks/bench_ranking.py), so it was not worth the dependency.
+
+import heapq
+import math
+from operator import attrgetter
+
+# Instances with fewer accounts in the search results than this are not ranked
+min_count = 3
+
+# Each strategy takes a list of pairs (instance, number of accounts found on it), sets inst.score on
+# every instance with at least min_count accounts that it can score and returns those instances. The
+# strategies loop over the instances themselves, since a function call per instance costs as much as
+# computing the score.
+
+def _relevance(candidates, active):
+    log = math.log
+    scored = list()
+    for inst, n in candidates:
+        if n < min_count: continue
+        users = inst.active_month if active else inst.users
+        if users is None: continue
+        try:
+            inst.score = 1 / (2 - log(n / users) * log(users)) * 1000
+        except (ValueError, ZeroDivisionError):
+            continue
+        scored.append(inst)
+    return scored
+
+# Accounts found relative to the size of the instance, damped for very small instances
+def relevance(candidates):
+    return _relevance(candidates, False)
+
+# Like relevance, but relative to the number of active users in the last month
+def active_relevance(candidates):
+    return _relevance(candidates, True)
+
+# Like relevance, but instances where few users are active are ranked lower
+def activity_weighted(candidates):
+    scored = relevance(candidates)
+    sqrt = math.sqrt
+    for inst in scored:
+        active_month = inst.active_month
+        if active_month is None or not inst.users: continue
+        inst.score *= sqrt(min(1, max(0, active_month / inst.users)))
+    return scored
+
+# Simply the number of accounts found
+def accounts_found(candidates):
+    scored = list()
+    for inst, n in candidates:
+        if n < min_count: continue
+        inst.score = n
+        scored.append(inst)
+    return scored
+
+strategies = {
+    'relevance': relevance,
+    'active': active_relevance,
+    'activity_weighted': activity_weighted,
+    'accounts': accounts_found,
+}
+
+# Ranks the given pairs (instance, number of accounts found on it). Sets inst.score on every instance
+# that can be scored and returns the k highest-scoring instances, highest first (equal scores in the
+# order of the pairs).
+def rank_instances(instances_with_counts, k = 20, strategy = 'relevance'):
+    scored = strategies[strategy](instances_with_counts)
+    # a heap only pays off if there are many more instances than we keep (for k = 20, from about
+    # 700 instances on)
+    if len(scored) > 32 * k:
+        return heapq.nlargest(k, scored, key = attrgetter('score'))
+    scored.sort(key = attrgetter('score'), reverse = True)
+    return scored[:k]
@@ -0,0 +1,95 @@
+import hashlib
+import secrets
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+# Keeps the results of searches on the server for a short while (settings.RESULT_CACHE_TTL seconds),
+# so that reloading the results page, doing the same search again or downloading the results does
+# not scan Twitter again (which takes long and uses up the user's rate limit).
+#
+# Every stored search gets a random ID, which is handed to the user's browser. The results are only
+# given out again to their owner, i.e. a request with the same Twitter credentials as the search (see
+# owner_of). Interactive searches are additionally found by their key (authenticated user, requested
+# user, action, selected lists).
+# The cache backend is the Django cache 'results' (see CACHES in the settings). Since the browser
+# comes back for the results in separate requests, which may be answered by any worker process, the
+# IDs are only handed out if that cache is shared by the worker processes (see is_shared).
+
+# actions whose results are found by their key
+cacheable_actions = ('getfollowed', 'getfollowers', 'getblocked', 'getmuted', 'getlist')
+
+class CachedResults:
+    def __init__(self, action, results, owner, lists = None, followed_lists = None, requested_lists = None, key = None):
+        self.id = secrets.token_urlsafe(16)
+        self.owner = owner # see owner_of
+        self.action = action
+        self.results = results # extract_mastodon_ids.Results
+        self.lists = lists
+        self.followed_lists = followed_lists
+        self.requested_lists = requested_lists
+        self.key = key
+        self.time = time.time()
+
+    @property
+    def age(self):
+        return time.time() - self.time
+
+def _cache():
+    return caches['results']
+
+# Whether the cache is shared between worker processes, i.e. not an in-memory cache
+def is_shared():
+    return not isinstance(_cache(), LocMemCache)
+
+def _key_id(key):
+    return 'key:' + hashlib.sha256(repr(key).encode()).hexdigest()
+
+# Identifies the owner of results by a hash of their Twitter access credentials (a pair of strings),
+# so that the credentials themselves are not stored
+def owner_of(access_credentials):
+    if access_credentials is None: return None
+    return hashlib.sha256(':'.join(access_credentials).encode()).hexdigest()
+
+# The key of an interactive search, or None if its results are not to be found by key. The key
+# contains the authenticated user, so the results found by it belong to the caller, even though they
+# may have been stored under other credentials of the same user (see views.handle_already_authorised).
+def search_key(me_id, requested_user_id, action, list_ids = ()):
+    if action not in cacheable_actions: return None
+    return (str(me_id), str(requested_user_id), action, tuple(sorted(str(x) for x in list_ids)))
+
+# The cached results with the given ID, or None if there are none or they belong to someone else
+def get(results_id, owner):
+    entry = _get(results_id)
+    if entry is None or owner is None or not secrets.compare_digest(entry.owner, owner): return None
+    return entry
+
+def _get(results_id):
+    if settings.RESULT_CACHE_TTL <= 0 or not results_id: return None
+    try:
+        return _cache().get('results:' + results_id)
+    except Exception as e:
+        print('Failed to read cached results:', e)
+        return None
+
+def get_by_key(key):
+    if settings.RESULT_CACHE_TTL <= 0 or key is None: return None
+    try:
+        results_id = _cache().get(_key_id(key))
+    except Exception as e:
+        print('Failed to read cached results:', e)
+        return None
+    return _get(results_id)
+
+def put(entry):
+    if settings.RESULT_CACHE_TTL <= 0: return None
+    try:
+        c = _cache()
+        c.set('results:' + entry.id, entry, settings.RESULT_CACHE_TTL)
+        if entry.key is not None:
+            c.set(_key_id(entry.key), entry.id, settings.RESULT_CACHE_TTL)
+    except Exception as e:
+        print('Failed to cache results:', e)
+        return None
+    return entry.id
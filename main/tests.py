@@ -1,3 +1,351 @@
-from django.test import TestCase
+import csv
+import json
+import random
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import tweepy
+from django.core.cache import caches
+from django.core.signals import request_started, request_finished
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from . import extract_mastodon_ids as e
+from . import http_client
+from . import result_cache
+from . import views
+from .instance import naked_instance
+
+# These tests need neither the database nor Twitter; run them with 'python3 manage.py test main'.
+
+def mk_user(i, name = '', location = '', description = '', pinned_tweet_id = None, entities = None):
+    data = {'id': str(i), 'name': name, 'username': f'u{i}', 'location': location, 'description': description}
+    if pinned_tweet_id is not None: data['pinned_tweet_id'] = str(pinned_tweet_id)
+    if entities is not None: data['entities'] = entities
+    return tweepy.User(data)
+
+def mk_user_result(i, mids, src = 'Following', name = None):
+    return e.UserResult(i, src, name or f'User {i}', f'u{i}', None, [e.MastodonID(*mid.split('@')) for mid in mids], None)
+
+
+# the pieces of text that are most likely to confuse the scanner
+_fragments = [
+    '@', '/', '/@', '/web/', '/WEB/@', 'web/', 'https://', 'http://', '.', ',', ':', ' ', '\n', '(', ')', '🐘', 'Mastodon:',
+    'mastodon', 'MASTODON', 'toot', 'TRÖT', 'fedi', 'foo', 'bar_1', 'x-y', 'mastodon.social', 'graz.social', 'example.com',
+    'co.uk', '.social', '..', '@@', '#', '?', '…']
+
+class TriggerScannerTest(SimpleTestCase):
+    def setUp(self):
+        self.extractor = e.MastodonIdExtractor(lambda host: True)
+
+    # every field that one of the original patterns finds something in has to have the trigger that
+    # lets the extractor run that pattern
+    def test_triggers_cover_original_patterns(self):
+        rng = random.Random(1)
+        texts = [''.join(rng.choice(_fragments) for _ in range(rng.randint(0, 20))) for _ in range(3000)]
+        texts += ['@foo@mastodon.social', 'https://graz.social/@foo', 'graz.social/web/@foo', 'mastodon.social/web/foo',
+            'Also on Mastodon', 'trötet auch', 'foo (at) example.com']
+        for text in texts:
+            triggers = e.scan_text(text)
+            if e._id_pattern1.findall(text):
+                self.assertTrue({e._TRIGGER_AT, e._TRIGGER_PATH_ID} & triggers, text)
+            if e._id_pattern2.findall(text):
+                self.assertIn(e._TRIGGER_PATH_ID, triggers, text)
+            if any(e.parse_mastodon_id_url(url) for url in self.extractor.url_extractor.find_urls(text)):
+                self.assertTrue({e._TRIGGER_PATH_ID, e._TRIGGER_WEB_PATH} & triggers, text)
+            if any(e._keyword_pattern.match(line) for line in text.splitlines()):
+                self.assertIn(e._TRIGGER_KEYWORD, triggers, text)
+
+    def test_scan_text(self):
+        self.assertEqual(e.scan_text(None), set())
+        self.assertEqual(e.scan_text('coffee and cats'), set())
+        self.assertEqual(e.scan_text('x.social/@foo'), {e._TRIGGER_PATH_ID})
+        self.assertEqual(e.scan_text('x.social/WEB/@foo'), {e._TRIGGER_PATH_ID})
+        self.assertEqual(e.scan_text('x.social/web/foo'), {e._TRIGGER_WEB_PATH})
+        self.assertEqual(e.scan_text('foo@x.social'), {e._TRIGGER_AT})
+        self.assertEqual(e.scan_text('Find me on the Fediverse'), {e._TRIGGER_KEYWORD})
+
+    def found(self, u, pinned_tweets = {}):
+        return [str(mid) for mid in self.extractor.extract_from_user(u, pinned_tweets).mastodon_ids]
+
+    def test_path_ids(self):
+        self.assertEqual(self.found(mk_user(1, name = 'Foo https://graz.social/@foo')), ['foo@graz.social'])
+        self.assertEqual(self.found(mk_user(2, location = 'graz.social/web/@foo')), ['foo@graz.social'])
+        self.assertEqual(self.found(mk_user(3, description = 'see https://graz.social/web/foo')), ['foo@graz.social'])
+        self.assertEqual(self.found(mk_user(4, description = 'see https://graz.social/about/more')), [])
+
+    def test_pinned_tweet(self):
+        tweets = {5: tweepy.Tweet({'id': '5', 'text': 'I moved to @foo@graz.social', 'edit_history_tweet_ids': ['5']})}
+        self.assertEqual(self.found(mk_user(1, pinned_tweet_id = 5), tweets), ['foo@graz.social'])
+        self.assertEqual(self.found(mk_user(1, pinned_tweet_id = 6), tweets), [])
+
+    def test_keyword_extras(self):
+        r = self.extractor.extract_from_user(mk_user(1, description = 'cats\nalso on mastodon\ncoffee'), {})
+        self.assertEqual(r.mastodon_ids, [])
+        self.assertEqual(r.extras, ['also on mastodon'])
+
+
+class DbCursorTest(SimpleTestCase):
+    # the account caches look accounts up from request threads as well as from background threads
+    def test_connection_per_thread_kind(self):
+        with mock.patch.object(views, 'connection') as connection, mock.patch('psycopg2.connect') as connect:
+            with views.db_cursor():
+                pass
+            self.assertEqual(connect.call_count, 1)
+            connect.return_value.close.assert_called_once()
+
+            request_started.send(sender = self.__class__)
+            try:
+                with views.db_cursor():
+                    pass
+                # other threads are still background threads while a request is being handled
+                def background():
+                    with views.db_cursor():
+                        pass
+                t = threading.Thread(target = background)
+                t.start()
+                t.join()
+            finally:
+                request_finished.send(sender = self.__class__)
+            connection.cursor.assert_called_once()
+            self.assertEqual(connect.call_count, 2)
+
+
+class HostSuffixTrieTest(SimpleTestCase):
+    def test_matches(self):
+        t = e.HostSuffixTrie(['Example.com', 'jabber.ccc.de'])
+        t.add('only.example.org', subdomains = False)
+        self.assertEqual(len(t), 3)
+        self.assertTrue(t.matches('example.com'))
+        self.assertTrue(t.matches('foo.EXAMPLE.com'))
+        self.assertTrue(t.matches('a.b.jabber.ccc.de'))
+        self.assertFalse(t.matches('ccc.de'))
+        self.assertFalse(t.matches('notexample.com'))
+        self.assertFalse(t.matches('com'))
+        self.assertTrue(t.matches('only.example.org'))
+        self.assertFalse(t.matches('sub.only.example.org'))
+        self.assertFalse(t.matches('example.org'))
+
+    def test_subdomains_win(self):
+        t = e.HostSuffixTrie()
+        t.add('example.org', subdomains = False)
+        t.add('example.org')
+        t.add('example.org', subdomains = False)
+        self.assertEqual(len(t), 1)
+        self.assertTrue(t.matches('sub.example.org'))
+
+
+class PrefetchedTest(SimpleTestCase):
+    # yields 0, 1, ..., n-1 (raising error instead of yielding fail_at) and counts how many items
+    # have been taken from it
+    def source(self, n, fail_at = None, error = None):
+        self.taken = 0
+        def gen():
+            for i in range(n):
+                if i == fail_at: raise error
+                self.taken += 1
+                yield i
+        return gen()
+
+    def wait_for_taken(self, n, timeout = 2):
+        end = time.monotonic() + timeout
+        while self.taken < n and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def test_all_items_in_order(self):
+        for lookahead in (0, 1, 3):
+            self.assertEqual(list(e.prefetched(self.source(10), lookahead)), list(range(10)))
+        self.assertEqual(list(e.prefetched(self.source(0), 1)), [])
+
+    def test_exception_from_source(self):
+        pages = e.prefetched(self.source(10, fail_at = 3, error = ValueError('no more pages')), 2)
+        self.assertEqual([next(pages) for _ in range(3)], [0, 1, 2])
+        with self.assertRaisesRegex(ValueError, 'no more pages'):
+            next(pages)
+
+    def test_lookahead_bound(self):
+        for lookahead in (1, 3):
+            pages = e.prefetched(self.source(100), lookahead)
+            self.assertEqual(next(pages), 0)
+            # while the first item is being processed, the next lookahead items are fetched, but no more
+            self.wait_for_taken(1 + lookahead)
+            time.sleep(0.2)
+            self.assertEqual(self.taken, 1 + lookahead)
+            self.assertEqual(next(pages), 1)
+            self.wait_for_taken(2 + lookahead)
+            time.sleep(0.2)
+            self.assertEqual(self.taken, 2 + lookahead)
+            pages.close()
+
+    def test_stops_when_closed(self):
+        threads = set(threading.enumerate())
+        pages = e.prefetched(self.source(100), 2)
+        self.assertEqual(next(pages), 0)
+        self.wait_for_taken(3)
+        pages.close()
+        # the fetching thread notices within its polling interval and takes nothing more
+        time.sleep(0.3)
+        self.assertEqual(self.taken, 3)
+        self.assertEqual(set(threading.enumerate()) - threads, set())
+
+
+@override_settings(RESULT_CACHE_TTL = 60, CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-results'}})
+class ResultCacheTest(SimpleTestCase):
+    def setUp(self):
+        caches['results'].clear()
+        self.results = e.Results()
+        self.results.add(mk_user_result(1, ['foo@graz.social']))
+        self.owner = result_cache.owner_of(('token', 'secret'))
+
+    def test_round_trip(self):
+        key = result_cache.search_key(1, 2, 'getlist', ['20', '3'])
+        entry = result_cache.CachedResults('getlist', self.results, self.owner, key = key)
+        results_id = result_cache.put(entry)
+        self.assertEqual(results_id, entry.id)
+        cached = result_cache.get(results_id, self.owner)
+        self.assertEqual(cached.action, 'getlist')
+        self.assertEqual([str(mid) for u in cached.results.get_results()[0] for mid in u.mastodon_ids], ['foo@graz.social'])
+        self.assertEqual(result_cache.get_by_key(result_cache.search_key('1', '2', 'getlist', ['3', '20'])).id, results_id)
+        self.assertIsNone(result_cache.get_by_key(result_cache.search_key(1, 2, 'getlist', ['3'])))
+
+    def test_owner(self):
+        results_id = result_cache.put(result_cache.CachedResults('getfollowed', self.results, self.owner))
+        self.assertIsNone(result_cache.get(results_id, result_cache.owner_of(('token', 'other'))))
+        self.assertIsNone(result_cache.get(results_id, None))
+        self.assertIsNone(result_cache.get('nonexistent', self.owner))
+
+    def test_search_key(self):
+        self.assertIsNone(result_cache.search_key(1, 2, 'upload'))
+        self.assertNotEqual(result_cache.search_key(1, 2, 'getfollowed'), result_cache.search_key(1, 2, 'getfollowers'))
+
+    @override_settings(RESULT_CACHE_TTL = 0)
+    def test_disabled(self):
+        self.assertIsNone(result_cache.put(result_cache.CachedResults('getfollowed', self.results, self.owner)))
+
+    def test_not_shared(self):
+        self.assertFalse(result_cache.is_shared())
+
+
+# This is how the CSV files were made before they could be streamed.
+def old_make_csv(users):
+    return '\n'.join(['Account address,Show boosts'] + ["{},true".format(mid) for u in users for mid in u.mastodon_ids])
+
+def old_make_full_csv(users):
+    with StringIO() as f:
+        w = csv.writer(f)
+        w.writerow([x for x, y in views._full_csv_fields] + ['Fediverse IDs'])
+        for u in users:
+            w.writerow([getattr(u, y) for x, y in views._full_csv_fields] + [mid for mid in u.mastodon_ids])
+        return f.getvalue()
+
+class CsvTest(SimpleTestCase):
+    def test_same_as_before(self):
+        users = [
+            mk_user_result(1, ['foo@graz.social', 'bar@mastodon.social']),
+            mk_user_result(2, [], name = 'Name, with "quotes"\nand a line break'),
+            mk_user_result(3, ['baz@x.social'], src = 'List: a, b'),
+        ]
+        for us in (users, users[:1], []):
+            self.assertEqual(''.join(views.chunked(views.iter_csv(us), 2)), old_make_csv(us))
+            self.assertEqual(''.join(views.chunked(views.iter_full_csv(us), 2)), old_make_full_csv(us))
+
+
+def get_test_instances(hosts):
+    return {host: naked_instance(host) for host in hosts}
+
+@override_settings(RESULT_CACHE_TTL = 60, TWITTER_CREDENTIALS_COOKIE = 'test_credentials', CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-results'}})
+@mock.patch('main.aggregate.get_instances', get_test_instances)
+class ResultsJsonTest(SimpleTestCase):
+    def setUp(self):
+        caches['results'].clear()
+        views._recent_aggregates.clear()
+        results = e.Results()
+        # 50 instances, one of them with more accounts than fit on a page
+        for i in range(300):
+            host = 'big.social' if i < 250 else f'host{i}.social'
+            results.add(mk_user_result(i, [f'user{i}@{host}']))
+        for i in range(49):
+            results.add(mk_user_result(1000 + i, [f'user@small{i}.social']))
+        self.entry = result_cache.CachedResults('getfollowed', results, result_cache.owner_of(('token', 'secret')))
+        result_cache.put(self.entry)
+        self.factory = RequestFactory()
+
+    def get(self, credentials = 'token:secret', **params):
+        request = self.factory.get('/results/json', {'id': self.entry.id, **params})
+        if credentials is not None: request.COOKIES['test_credentials'] = credentials
+        return views.results_json(request)
+
+    def get_json(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_pages(self):
+        first = self.get_json(page = 0)
+        n_pages = first['n_pages']
+        self.assertEqual(first['n_instances'], 100)
+        hosts = list()
+        for page in range(n_pages):
+            data = self.get_json(page = page)
+            self.assertEqual(data['page'], page)
+            self.assertEqual(data['n_pages'], n_pages)
+            self.assertLessEqual(len(data['instances']), views.results_page_instances)
+            n_accounts = sum(len(inst['accounts']) for inst in data['instances'])
+            self.assertTrue(n_accounts <= views.results_page_accounts or len(data['instances']) == 1)
+            hosts += [inst['host'] for inst in data['instances']]
+            self.assertEqual([inst['index'] for inst in data['instances']], list(range(len(hosts) - len(data['instances']), len(hosts))))
+        by_instance = views._recent_aggregates[self.entry.id][2].mastodon_ids_by_instance
+        self.assertEqual(hosts, [inst.host for inst, _ in by_instance])
+        self.assertEqual(self.get(page = n_pages).status_code, 404)
+        self.assertEqual(self.get(page = 'x').status_code, 404)
+
+    def test_instance(self):
+        data = self.get_json(instance = 0)
+        self.assertIsNone(data['page'])
+        self.assertEqual(len(data['instances']), 1)
+        self.assertEqual(data['instances'][0]['host'], 'big.social')
+        self.assertEqual(len(data['instances'][0]['accounts']), 250)
+        self.assertEqual(self.get(instance = data['n_instances']).status_code, 404)
+
+    def test_owner(self):
+        self.assertEqual(self.get(page = 0).status_code, 200)
+        self.assertEqual(self.get(credentials = 'token:other', page = 0).status_code, 404)
+        self.assertEqual(self.get(credentials = None, page = 0).status_code, 404)
+
+    def test_etag(self):
+        response = self.get(page = 1)
+        etag = response['ETag']
+        self.assertEqual(self.get(page = 1)['ETag'], etag)
+        self.assertNotEqual(self.get(page = 0)['ETag'], etag)
+        request = self.factory.get('/results/json', {'id': self.entry.id, 'page': 1}, HTTP_IF_NONE_MATCH = etag)
+        request.COOKIES['test_credentials'] = 'token:secret'
+        self.assertEqual(views.results_json(request).status_code, 304)
+        # the account statuses change while they are being checked
+        with mock.patch.object(e.account_statuses, 'lookup_many', lambda accounts: dict()):
+            self.assertFalse(self.get(page = 1, verify = 1).has_header('ETag'))
+
+
+class HostHealthTest(SimpleTestCase):
+    def test_ports_are_separate_hosts(self):
+        tracker = http_client.HealthTracker()
+        blocked = http_client.host_key('https://mastodon.social:1/.well-known/webfinger')
+        for _ in range(http_client.failure_threshold):
+            tracker.before_request(blocked)
+            tracker.record_failure(blocked)
+        with self.assertRaises(http_client.HostUnavailable):
+            tracker.before_request(blocked)
+        tracker.before_request(http_client.host_key('https://mastodon.social/.well-known/webfinger'))
+        self.assertEqual(http_client.host_key('https://mastodon.social/'), http_client.host_key('https://MASTODON.social:443/'))
+
+    def test_profile_rejects_other_hosts(self):
+        factory = RequestFactory()
+        for user, host in (('a', 'mastodon.social:1'), ('a/b', 'mastodon.social'), ('a', 'localhost'), ('a', 'x.social/y')):
+            with mock.patch.object(e.MastodonID, 'profile_url') as profile_url:
+                response = views.profile(factory.get('/profile', {'user': user, 'host': host}))
+            self.assertEqual(response.status_code, 200)
+            profile_url.assert_not_called()
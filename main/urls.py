@@ -6,5 +6,8 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('profile', views.profile, name='profile'),
     path('batch', views.batch, name='batch'),
-    path('batch/progress', views.batch_progress, name='batch_progress')
+    path('batch/progress', views.batch_progress, name='batch_progress'),
+    path('results/csv', views.results_csv, name='results_csv'),
+    path('results/full_csv', views.results_full_csv, name='results_full_csv'),
+    path('results/json', views.results_json, name='results_json')
 ]
@@ -1,25 +1,36 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
 from django.views.decorators.gzip import gzip_page
 from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import condition
+from django.template.defaultfilters import title
 from django.core.exceptions import PermissionDenied
 from django.db import connection
+from django.core.signals import request_started, request_finished
+import psycopg2
 import tweepy
 from tweepy import TweepyException
 import re
 import datetime
 import traceback
-import math
 import codecs
 import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from io import TextIOWrapper
 from functools import total_ordering
+from itertools import islice
 
 from . import extract_mastodon_ids
 from .instance import Instance, get_instance
 from .json_path import *
 from . import batch as batchtools
+from . import aggregate
+from . import result_cache
 
 class RequestedUserSrc:
     pass    
@@ -126,8 +137,14 @@ def handle_auth_request(request):
     auth_url = oauth1.get_authorization_url()
     return render(request, "auth.html", {'auth_url': auth_url})
 
+def iter_csv(users):
+    yield 'Account address,Show boosts'
+    for u in users:
+        for mid in u.mastodon_ids:
+            yield '\n{},true'.format(mid)
+
 def make_csv(users):
-    return '\n'.join(['Account address,Show boosts'] + ["{},true".format(mid) for u in users for mid in u.mastodon_ids])
+    return ''.join(iter_csv(users))
     
 _full_csv_fields = [
     ('Twitter User ID', 'uid'),
@@ -135,16 +152,31 @@ _full_csv_fields = [
     ('Twitter display name', 'name'),
     ('Source', 'src'),
     ('Is on Fediverse', 'is_on_fediverse')]
-    
-def make_full_csv(users):
-    from io import StringIO
+
+# a file-like object for csv.writer that hands back the lines instead of writing them anywhere
+class _Echo:
+    def write(self, value):
+        return value
+
+def iter_full_csv(users):
     import csv
-    with StringIO() as f:
-        w = csv.writer(f)
-        w.writerow([x for x, y in _full_csv_fields] + ['Fediverse IDs'])
-        for u in users:
-            w.writerow([getattr(u, y) for x, y in _full_csv_fields] + [mid for mid in u.mastodon_ids])
-        return f.getvalue()
+    w = csv.writer(_Echo())
+    yield w.writerow([x for x, y in _full_csv_fields] + ['Fediverse IDs'])
+    for u in users:
+        yield w.writerow([getattr(u, y) for x, y in _full_csv_fields] + [mid for mid in u.mastodon_ids])
+
+def make_full_csv(users):
+    return ''.join(iter_full_csv(users))
+
+# joins the lines into chunks of n lines each, so that a streamed response is not sent line by line
+def chunked(lines, n = 1000):
+    chunk = list()
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= n:
+            yield ''.join(chunk)
+            chunk = list()
+    if chunk: yield ''.join(chunk)
 
 def increase_access_counter():
     try:
@@ -288,7 +320,7 @@ def get_job_results(job_secret):
                 results.n_users += 1
         return results
 
-def show_error(request, message):
+def show_error(request, message, status = 200):
     if 'screenname' in request.POST:
         screenname = request.POST['screenname']
         if screenname[:1] == '@': screenname = screenname[1:]
@@ -306,7 +338,7 @@ def show_error(request, message):
       'is_me': 'screenname' not in request.POST,
       'csv': None
     }
-    response = render(request, "displayresults.html", context)
+    response = render(request, "displayresults.html", context, status = status)
     return response
 
 def get_privileges(username):
@@ -323,6 +355,118 @@ def ensure_privilege(username, privilege):
     if not has_privilege(username, privilege):
         raise PermissionDenied
 
+# The database callbacks of the caches below are called both from request threads (e.g. when a results
+# page looks up account statuses) and from the caches' background threads. Request threads use Django's
+# connection, which Django checks and closes at the end of every request. In background threads,
+# Django never does that, so a connection that broke (e.g. because Postgres was restarted) would stay
+# broken for the life of the process; they open a short-lived connection of their own for every call.
+_request_thread = threading.local()
+
+def _request_started(**kwargs):
+    _request_thread.active = True
+
+def _request_finished(**kwargs):
+    _request_thread.active = False
+
+request_started.connect(_request_started)
+request_finished.connect(_request_finished)
+
+@contextmanager
+def db_cursor():
+    if getattr(_request_thread, 'active', False):
+        with connection.cursor() as cur:
+            yield cur
+        return
+    db = settings.DATABASES['default']
+    con = psycopg2.connect(dbname = db['NAME'], user = db['USER'], password = db['PASSWORD'], host = db['HOST'] or None, port = db['PORT'] or None)
+    try:
+        con.autocommit = True
+        with con.cursor() as cur:
+            yield cur
+    finally:
+        con.close()
+
+def load_known_instances():
+    with db_cursor() as cur:
+        cur.execute('SELECT name, software IS NOT NULL FROM instances')
+        return cur.fetchall()
+
+def record_unknown_hosts(hosts):
+    with db_cursor() as cur:
+        cur.execute('INSERT INTO unknown_hosts (name) SELECT UNNEST(%s) ON CONFLICT DO NOTHING', [hosts])
+
+# Hosts that test_instances.py found not to be Fediverse instances
+def load_bad_hosts():
+    with db_cursor() as cur:
+        cur.execute('CREATE TABLE IF NOT EXISTS bad_hosts (name TEXT NOT NULL PRIMARY KEY)')
+        cur.execute('SELECT name FROM bad_hosts')
+        return [row[0] for row in cur.fetchall()]
+
+def load_webfinger_templates():
+    with db_cursor() as cur:
+        cur.execute('CREATE TABLE IF NOT EXISTS webfinger_templates (name TEXT NOT NULL PRIMARY KEY, template TEXT, expires TIMESTAMP WITH TIME ZONE NOT NULL)')
+        cur.execute('SELECT name, template, EXTRACT(EPOCH FROM expires) FROM webfinger_templates WHERE expires > NOW()')
+        return [(row[0], row[1], float(row[2])) for row in cur.fetchall()]
+
+def store_webfinger_templates(entries):
+    with db_cursor() as cur:
+        cur.execute('INSERT INTO webfinger_templates (name, template, expires) SELECT n, t, TO_TIMESTAMP(e) FROM UNNEST(%s::text[], %s::text[], %s::float8[]) AS x(n, t, e) '
+            'ON CONFLICT (name) DO UPDATE SET template = EXCLUDED.template, expires = EXCLUDED.expires',
+            [[e[0] for e in entries], [e[1] for e in entries], [e[2] for e in entries]])
+        cur.execute('DELETE FROM webfinger_templates WHERE expires <= NOW()')
+
+def biggest_instances():
+    with db_cursor() as cur:
+        cur.execute('SELECT name FROM instances WHERE COALESCE(dead, 0) = 0 ORDER BY users DESC NULLS LAST LIMIT %s', [settings.WEBFINGER_PREWARM_HOSTS])
+        return [row[0] for row in cur.fetchall()]
+
+# The webfinger templates of all hosts are shared by all workers through the database
+extract_mastodon_ids.webfinger_templates.configure(load_webfinger_templates, store_webfinger_templates,
+    biggest_instances if settings.WEBFINGER_PREWARM_HOSTS > 0 else None)
+
+# Returns the load and store callbacks of an extract_mastodon_ids.AccountCache that is backed by the
+# given table (which is created on first use); the cached value is kept in the given column.
+def account_cache_callbacks(table, column):
+    table_created = False
+
+    # the first store may well come before the first load (e.g. after a search with fresh answers)
+    def ensure_table(cur):
+        nonlocal table_created
+        if not table_created:
+            cur.execute(f'CREATE TABLE IF NOT EXISTS {table} (name TEXT NOT NULL PRIMARY KEY, {column} TEXT, checked TIMESTAMP WITH TIME ZONE NOT NULL, latency REAL)')
+            table_created = True
+
+    def load(accounts):
+        with db_cursor() as cur:
+            ensure_table(cur)
+            cur.execute(f'SELECT name, {column}, EXTRACT(EPOCH FROM checked), latency FROM {table} WHERE name = ANY(%s)', [accounts])
+            return [(row[0], row[1], float(row[2]), row[3]) for row in cur.fetchall()]
+
+    def store(entries):
+        with db_cursor() as cur:
+            ensure_table(cur)
+            cur.execute(f'INSERT INTO {table} (name, {column}, checked, latency) SELECT n, v, TO_TIMESTAMP(c), l FROM UNNEST(%s::text[], %s::text[], %s::float8[], %s::real[]) AS x(n, v, c, l) '
+                f'ON CONFLICT (name) DO UPDATE SET {column} = EXCLUDED.{column}, checked = EXCLUDED.checked, latency = EXCLUDED.latency',
+                [[e[0] for e in entries], [e[1] for e in entries], [e[2] for e in entries], [e[3] for e in entries]])
+            cur.execute(f"DELETE FROM {table} WHERE checked < NOW() - INTERVAL '30 days'")
+
+    return load, store
+
+# Whether accounts exist and where their profile pages are is remembered across requests and workers
+extract_mastodon_ids.account_statuses.configure(*account_cache_callbacks('account_status', 'status'))
+extract_mastodon_ids.profile_urls.configure(*account_cache_callbacks('profile_urls', 'url'))
+
+# Known instances are kept in memory by every worker, so validating hosts needs no database queries
+known_instances = extract_mastodon_ids.KnownInstanceIndex(load_known_instances, record_unknown_hosts, load_bad_hosts)
+
+# Extractors are built once per worker and shared by all requests (see MastodonIdExtractor).
+# The second one accepts every host and is used to find broken IDs in the requested user's profile.
+extractor = extract_mastodon_ids.MastodonIdExtractor(
+    known_hosts_callback = known_instances.known_hosts, forbidden_host_callback = known_instances.is_forbidden,
+    workers = settings.EXTRACTION_WORKERS)
+extractor.start_pool()
+lax_extractor = extract_mastodon_ids.MastodonIdExtractor(lambda s: True)
+
 def handle_already_authorised(request, client, access_credentials):
     screenname = ''
     privileges = set()
@@ -348,38 +492,22 @@ def handle_already_authorised(request, client, access_credentials):
             
         privileges = get_privileges(me.username)
 
-        def known_host_callback(s):
-            try:
-                with connection.cursor() as cur:
-                    cur.execute('SELECT name, software FROM instances WHERE name=%s LIMIT 1', [s])
-                    row = cur.fetchone()
-                    if row is None:
-                        try:
-                            cur.execute('INSERT INTO unknown_hosts (name) VALUES (%s);', [s])
-                        except:
-                            pass
-                    else:
-                        return (row['software'] is not None)
-            except Exception as e:
-                return False
-
         broken_mastodon_ids = []
         requested_user_mastodon_ids = []
         requested_user_results = extract_mastodon_ids.Results()
-        extract_mastodon_ids.extract_mastodon_ids_from_users(client, None, requested_user_resp, requested_user_results, known_host_callback)
+        extract_mastodon_ids.extract_mastodon_ids_from_users(client, None, requested_user_resp, requested_user_results, extractor = extractor)
         requested_user_mastodon_ids = requested_user_results.get_results()[0]
         if requested_user_mastodon_ids:
             requested_user_mastodon_ids = requested_user_mastodon_ids[0].mastodon_ids
-            for mid in requested_user_mastodon_ids:
-                mid.query_exists()
         requested_user_results = extract_mastodon_ids.Results()
-        extract_mastodon_ids.extract_mastodon_ids_from_users(client, None, requested_user_resp, requested_user_results, lambda s: True)
+        extract_mastodon_ids.extract_mastodon_ids_from_users(client, None, requested_user_resp, requested_user_results, extractor = lax_extractor)
         broken_mastodon_ids = list()
         for u in requested_user_results.get_results()[0]:
             for mid in u.mastodon_ids:
                 if mid not in requested_user_mastodon_ids:
                     broken_mastodon_ids.append(mid)
-                    mid.query_exists()
+        # users looking at their own profile (e.g. after fixing it) get an up-to-date answer
+        extract_mastodon_ids.verify_mastodon_ids(requested_user_mastodon_ids + broken_mastodon_ids, fresh = is_me)
 
         lists = None
         results = None
@@ -392,9 +520,24 @@ def handle_already_authorised(request, client, access_credentials):
         n_users = None
         action_taken = True
         uploaded_list_errors = {}
-        n_accounts_found = 0
 
-        if 'job_secret' in request.GET:
+        # repeated searches are answered from the result cache unless the user asks for a new search
+        refresh = 'refresh' in request.POST
+        cache_key = None
+        cached = None
+        if 'job_secret' not in request.GET:
+            cache_action = next((a for a in result_cache.cacheable_actions if a in request.POST), None)
+            list_ids = [k[5:] for k in request.POST if k.startswith('list_')] if cache_action == 'getlist' else []
+            cache_key = result_cache.search_key(me.id, requested_user.id, cache_action, list_ids)
+            if not refresh: cached = result_cache.get_by_key(cache_key)
+
+        if cached is not None:
+            action = cached.action
+            results = cached.results
+            lists = cached.lists
+            followed_lists = cached.followed_lists
+            requested_lists = cached.requested_lists
+        elif 'job_secret' in request.GET:
             action = 'jobresults'
             results = get_job_results(request.GET['job_secret'])
             if results is None:
@@ -402,19 +545,19 @@ def handle_already_authorised(request, client, access_credentials):
         elif 'getfollowed' in request.POST:
             action = 'getfollowed'
             results = extract_mastodon_ids.extract_mastodon_ids_from_pseudolist(
-                client, requested_user, extract_mastodon_ids.pl_following, known_host_callback = known_host_callback)
+                client, requested_user, extract_mastodon_ids.pl_following, extractor = extractor)
         elif 'getfollowers' in request.POST:
             action = 'getfollowers'
             results = extract_mastodon_ids.extract_mastodon_ids_from_pseudolist(
-                client, requested_user, extract_mastodon_ids.pl_followers, known_host_callback = known_host_callback)
+                client, requested_user, extract_mastodon_ids.pl_followers, extractor = extractor)
         elif 'getblocked' in request.POST:
             action = 'getblocked'
             results = extract_mastodon_ids.extract_mastodon_ids_from_pseudolist(
-                client, requested_user, extract_mastodon_ids.pl_blocked, known_host_callback = known_host_callback)
+                client, requested_user, extract_mastodon_ids.pl_blocked, extractor = extractor)
         elif 'getmuted' in request.POST:
             action = 'getmuted'
             results = extract_mastodon_ids.extract_mastodon_ids_from_pseudolist(
-                client, requested_user, extract_mastodon_ids.pl_muted, known_host_callback = known_host_callback)
+                client, requested_user, extract_mastodon_ids.pl_muted, extractor = extractor)
         elif 'getlists' in request.POST:
             action = 'getlists'
             lists = extract_mastodon_ids.get_lists(client, requested_user)
@@ -437,7 +580,7 @@ def handle_already_authorised(request, client, access_credentials):
             uploaded_users = uploaded_list + list_entry
             src = 'Direct Upload'
             
-            results, errors = extract_mastodon_ids.extract_mastodon_ids_from_users_raw(client, src, uploaded_users, known_host_callback = known_host_callback)
+            results, errors = extract_mastodon_ids.extract_mastodon_ids_from_users_raw(client, src, uploaded_users, extractor = extractor)
 
             uploaded_list_errors = uploaded_list_errors + list_entry_errors + errors
             uploaded_list_errors.sort(key = (lambda u: u.src))
@@ -458,9 +601,9 @@ def handle_already_authorised(request, client, access_credentials):
             for pl in extract_mastodon_ids.pseudolists:
                 if f'list_{pl.id}' in request.POST:
                     other_results[pl] = extract_mastodon_ids.extract_mastodon_ids_from_pseudolist(
-                        client, requested_user, pl, known_host_callback = known_host_callback)
+                        client, requested_user, pl, extractor = extractor)
                 
-            results = extract_mastodon_ids.extract_mastodon_ids_from_lists(client, requested_list_ids, known_host_callback=known_host_callback)
+            results = extract_mastodon_ids.extract_mastodon_ids_from_lists(client, requested_list_ids, extractor=extractor)
             
             for pl in extract_mastodon_ids.pseudolists:
                 if pl in other_results:
@@ -472,71 +615,51 @@ def handle_already_authorised(request, client, access_credentials):
         if action_taken:
             increase_access_counter()
 
+        results_id = None
+        owner = result_cache.owner_of(access_credentials)
+        entry = cached
+        if cached is not None:
+            results_id = cached.id
+            # the same user may have logged in again since (with new credentials)
+            if cached.owner != owner:
+                cached.owner = owner
+                result_cache.put(cached)
+        elif results is not None:
+            entry = result_cache.CachedResults(action, results, owner, lists = lists,
+                followed_lists = followed_lists, requested_lists = requested_lists, key = cache_key)
+            results_id = result_cache.put(entry)
+        # the other requests for these results (downloads, more of the instance list) may go to other
+        # worker processes; if they cannot find them there, the page has to contain everything
+        if not result_cache.is_shared():
+            results_id = None
+
         if results is not None:
             mid_results, extra_results, all_results = results.get_results()
             n_users = results.n_users
 
-        n_accounts_found = sum([len(u.mastodon_ids) for u in mid_results])
+        verify = 'verify' in request.POST
+        if verify and mid_results:
+            extract_mastodon_ids.verify_mastodon_ids([mid for u in mid_results for mid in u.mastodon_ids])
+        if settings.PRERESOLVE_PROFILE_URLS > 0 and mid_results:
+            extract_mastodon_ids.resolve_profile_urls_in_background(
+                islice((mid for u in mid_results for mid in u.mastodon_ids), settings.PRERESOLVE_PROFILE_URLS))
 
-        mastodon_ids_by_instance = dict()
-        for u in mid_results:
-            for mid in u.mastodon_ids:
-                if mid.host_part in mastodon_ids_by_instance:
-                    mastodon_ids_by_instance[mid.host_part].append((u, mid))
-                else:
-                    mastodon_ids_by_instance[mid.host_part] = [(u, mid)]
-        mastodon_ids_by_instance = {get_instance(i): us for i, us in mastodon_ids_by_instance.items()}
-        mastodon_ids_by_instance_list = sorted(mastodon_ids_by_instance.items(), key = lambda x: x[0].compare_key(x[1]))
-        tmp = 0
-        for inst, _ in mastodon_ids_by_instance_list:
-            inst.index = tmp
-            inst.index_plus_one = tmp + 1
-            tmp += 1
-                    
-        service_stats = dict()
-        for inst, us in mastodon_ids_by_instance.items():
-            if inst.software is None:
-                software = 'Unknown'
-            else:
-                software = inst.software.title()
-            if software in service_stats:
-                service_stats[software] += len(us)
-            else:
-                service_stats[software] = len(us)
-        def service_key(x):
-            if x[0] == 'Unknown':
-                return 1
-            else:
-                return -int(x[1])
-        service_stats = sorted(service_stats.items(), key = service_key)
-        
-        most_relevant_instances = list()
-        for inst, us in mastodon_ids_by_instance.items():
-            if inst.users is None or len(us) <= 2: continue
-            try:
-                inst.score = 1 / (2 - math.log(len(us) / inst.users) * math.log(inst.users)) * 1000
-            except:
-                continue
-            most_relevant_instances.append(inst)
-        most_relevant_instances.sort(key = (lambda inst: inst.score), reverse = True)
-        n_most_relevant = 20
-        most_relevant_instances = most_relevant_instances[:n_most_relevant]
-        if len(most_relevant_instances) <= 1: most_relevant_instances = None
-        if most_relevant_instances:
-            max_score = max([inst.score for inst in most_relevant_instances])
-            for inst in most_relevant_instances:
-                inst.rel_score = inst.score / max_score * 100
+        aggregates = aggregate.ResultAggregator(ranking_strategy = settings.INSTANCE_RANKING)
+        aggregates.add_all(mid_results)
+        # with cached results, the page only contains the first page of the instance list; the
+        # browser gets the rest from results_json
+        if results_id is not None:
+            remember_aggregates(entry, aggregates)
+            pages = result_pages(aggregates.mastodon_ids_by_instance)
+            listed_instances = aggregates.mastodon_ids_by_instance[:pages[0][1]] if pages else []
         else:
-            max_score = 0.0
+            pages = []
+            listed_instances = aggregates.mastodon_ids_by_instance
 
         context = {
             'action': action,
             'mastodon_id_users': mid_results,
-            'n_accounts_found': n_accounts_found,
-            'mastodon_ids_by_instance': mastodon_ids_by_instance_list,
-            'service_stats': service_stats,
-            'max_score': max_score,
-            'most_relevant_instances': most_relevant_instances,
+            **aggregates.context(),
             'requested_user_broken_mastodon_ids': broken_mastodon_ids,
             'requested_user_mastodon_ids': requested_user_mastodon_ids,
             'keyword_users': extra_results,
@@ -545,12 +668,20 @@ def handle_already_authorised(request, client, access_credentials):
             'requested_name': screenname, 
             'requested_lists': requested_lists,
             'n_users_searched': n_users,
+            'verify': verify,
+            'results_id': results_id,
+            'listed_instances': listed_instances,
+            'n_result_pages': len(pages),
+            'results_age': None if cached is None else int(cached.age / 60),
+            'cache_action': None if cache_key is None else cache_key[2],
+            'cache_list_ids': [] if cache_key is None else cache_key[3],
             'uploaded_list_errors': sorted(uploaded_list_errors.items(), key = lambda x: x[0]),
             'list_entry': request.POST.get('list_entry') or "",
             'me' : me,
             'is_me': is_me,
-            'csv': make_csv(mid_results),
-            'full_csv': make_full_csv(all_results),
+            # without a result cache, the CSV files have to be part of the page
+            'csv': make_csv(mid_results) if results_id is None else None,
+            'full_csv': make_full_csv(all_results) if results_id is None else None,
             'lists': lists,
             'followed_lists': followed_lists,
             'privileges': privileges
@@ -631,9 +762,15 @@ def try_get_twitter_credentials(request):
     if len(xs) != 2: return None
     return xs[0].strip(), xs[1].strip()
 
+# user and host names (without ports) as they occur in Mastodon IDs
+_profile_user_pattern = re.compile(r'[\w\-\.]+')
+_profile_host_pattern = re.compile(r'[\w\-]+(\.[\w\-]+)+')
+
 def profile(request):
     if 'user' not in request.GET or 'host' not in request.GET:
         return render(request, "error2.html", {})
+    if _profile_user_pattern.fullmatch(request.GET['user']) is None or _profile_host_pattern.fullmatch(request.GET['host']) is None:
+        return render(request, "error2.html", {})
     user = extract_mastodon_ids.MastodonID(request.GET['user'], request.GET['host'])
     url = user.profile_url()
     if url is None:
@@ -642,6 +779,160 @@ def profile(request):
 
 
 
+_csv_filenames = {
+    'getfollowed': 'following_accounts.csv',
+    'getfollowers': 'followers_accounts.csv',
+    'getblocked': 'blocked_accounts.csv',
+    'getmuted': 'muted_accounts.csv',
+    'getlist': 'list_accounts.csv',
+}
+
+# The cached results (see result_cache) whose ID is in the request, or None if there are none or
+# they belong to someone else than the user whose credentials are in the request
+def requested_results(request):
+    return result_cache.get(request.GET.get('id'), result_cache.owner_of(try_get_twitter_credentials(request)))
+
+# Streams a CSV file made from the cached results of a search
+def stream_results_csv(request, make_lines):
+    entry = requested_results(request)
+    if entry is None:
+        return show_error(request, 'These results are no longer available. Please search again.', status = 404)
+    response = StreamingHttpResponse(chunked(make_lines(entry.results)), content_type = 'text/csv; charset=utf-8')
+    filename = _csv_filenames.get(entry.action, 'accounts.csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private'
+    return response
+
+@gzip_page
+def results_csv(request):
+    return stream_results_csv(request, lambda results: iter_csv(results.get_results()[0]))
+
+@gzip_page
+def results_full_csv(request):
+    return stream_results_csv(request, lambda results: iter_full_csv(results.get_results()[2]))
+
+# The instance list of a results page is served in pages of consecutive instances, each with at most
+# results_page_instances instances and (unless a single instance has more) results_page_accounts accounts
+results_page_instances = 20
+results_page_accounts = 200
+
+# Returns the pages of the given instance list as pairs (start, end) of indices
+def result_pages(by_instance):
+    pages = list()
+    start = 0
+    n = 0
+    for k, (inst, us) in enumerate(by_instance):
+        if k > start and n + len(us) > results_page_accounts:
+            pages.append((start, k))
+            start = k
+            n = 0
+        n += len(us)
+        if k + 1 - start >= results_page_instances:
+            pages.append((start, k + 1))
+            start = k + 1
+            n = 0
+    if start < len(by_instance): pages.append((start, len(by_instance)))
+    return pages
+
+# The aggregates of the most recently shown results, so that loading the pages of the instance list
+# does not fetch the results from the cache (and unpickle them), look up, sort and rank all instances
+# again for every page. Like the cached results, they are only given out to their owner, and only
+# as long as the results would be in the cache.
+max_recent_aggregates = 16
+_recent_aggregates = OrderedDict() # results ID -> (owner, time of the search, ResultAggregator)
+_recent_aggregates_lock = threading.Lock()
+
+def remember_aggregates(entry, aggregates):
+    with _recent_aggregates_lock:
+        _recent_aggregates[entry.id] = (entry.owner, entry.time, aggregates)
+        _recent_aggregates.move_to_end(entry.id)
+        while len(_recent_aggregates) > max_recent_aggregates:
+            _recent_aggregates.popitem(last = False)
+
+# The remembered aggregates of the results with the given ID, or None
+def recent_aggregates(results_id, owner):
+    with _recent_aggregates_lock:
+        x = _recent_aggregates.get(results_id)
+    if x is None or owner is None or x[0] != owner or time.time() - x[1] > settings.RESULT_CACHE_TTL: return None
+    return x[2]
+
+# The aggregates of the results whose ID is in the request (see requested_results), or None
+def requested_aggregates(request):
+    owner = result_cache.owner_of(try_get_twitter_credentials(request))
+    aggregates = recent_aggregates(request.GET.get('id'), owner)
+    if aggregates is None:
+        entry = result_cache.get(request.GET.get('id'), owner)
+        if entry is None: return None
+        aggregates = aggregate.ResultAggregator(ranking_strategy = settings.INSTANCE_RANKING)
+        aggregates.add_all(entry.results.get_results()[0])
+        remember_aggregates(entry, aggregates)
+    return aggregates
+
+def instance_json(inst, us, statuses = None):
+    def exists(mid):
+        if statuses is None: return None
+        return statuses.get(str(mid), mid.exists)
+    return {
+        'index': inst.index,
+        'host': inst.host,
+        'icon': inst.icon,
+        'software': inst.software,
+        'software_title': None if inst.software is None else title(inst.software),
+        'software_version': inst.software_version,
+        'registrations_open': inst.registrations_open,
+        'dead': bool(inst.dead),
+        'country': None if inst.country is None else {'name': inst.country.name, 'flag': inst.country.flag},
+        'stats': inst.stats,
+        'last_update_pretty': inst.last_update_pretty,
+        'users': inst.users,
+        'score': getattr(inst, 'score', None),
+        'accounts': [{'name': u.name, 'screenname': u.screenname, 'user': mid.user_part, 'host': mid.host_part, 'exists': exists(mid)} for u, mid in us],
+    }
+
+# The results never change for the same ID, so the query string (and the owner, since no one else
+# gets them) identifies the answer; with 'verify', the answer contains the account statuses known so
+# far, which do change
+def results_json_etag(request):
+    if 'id' not in request.GET or 'verify' in request.GET: return None
+    owner = result_cache.owner_of(try_get_twitter_credentials(request)) or ''
+    return hashlib.sha256((request.GET.urlencode() + ':' + owner).encode()).hexdigest()
+
+# Serves the instance list of cached results (see result_cache) as JSON, either one page of it
+# (?id=...&page=n, see result_pages) or a single instance (?id=...&instance=n). With 'verify', the
+# accounts contain whether they exist, as far as that is known already.
+@gzip_page
+@condition(etag_func = results_json_etag)
+def results_json(request):
+    aggregates = requested_aggregates(request)
+    if aggregates is None:
+        return JsonResponse({'error': 'These results are no longer available. Please search again.'}, status = 404)
+    by_instance = aggregates.mastodon_ids_by_instance
+    pages = result_pages(by_instance)
+    try:
+        if 'instance' in request.GET:
+            k = int(request.GET['instance'])
+            if k < 0 or k >= len(by_instance): raise ValueError
+            page = None
+            selected = by_instance[k:k+1]
+        else:
+            page = int(request.GET.get('page', '0'))
+            if page < 0 or page >= len(pages): raise ValueError
+            selected = by_instance[pages[page][0]:pages[page][1]]
+    except ValueError:
+        return JsonResponse({'error': 'No such page or instance.'}, status = 404)
+
+    statuses = None
+    if 'verify' in request.GET:
+        statuses = extract_mastodon_ids.account_statuses.lookup_many([str(mid) for _, us in selected for _, mid in us])
+    response = JsonResponse({
+        'page': page,
+        'n_pages': len(pages),
+        'n_instances': len(by_instance),
+        'instances': [instance_json(inst, us, statuses) for inst, us in selected],
+    })
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
 def wrap_auth(request, callback):
     def go(access_credentials):
         client = tweepy.Client(
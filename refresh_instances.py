@@ -2,6 +2,7 @@ import os
 import json
 import psycopg2
 import requests
+from main import instance_display
 
 env_api_token = 'DEBIRDIFY_INSTANCE_API_TOKEN'
 
@@ -42,8 +43,14 @@ instances = [i for dat in data['instances'] if (i := parse_instance(dat)) is not
 
 con = psycopg2.connect(f"dbname=debirdify user={db_user} password={db_password}")
 #con.execute(create_command)
+# the display columns are added (once) before the refresh transaction starts
+instance_display.ensure_display_columns(con)
 with con.cursor() as cur:
     cur.executemany('INSERT INTO instances (name, dead, up, uptime, last_update, registrations_open, users) VALUES (%s, CAST(%s AS INTEGER), CAST(%s AS INTEGER), %s, %s, CAST(%s AS INTEGER), %s) ON CONFLICT(name) DO UPDATE SET uptime=COALESCE(excluded.uptime, instances.uptime)', instances)
+    # precompute what the web app displays about every instance
+    instance_display.materialize_display_fields(con)
+    # tell the web workers to drop their cached instances (see main/instance.py)
+    cur.execute('NOTIFY instances_changed')
 con.commit()
 con.close()
 
@@ -4,6 +4,7 @@ import os
 import json
 import psycopg2
 import requests
+from main import instance_display
 
 api_endpoint = 'https://fedifinder.glitch.me/api/known_instances.json'
 create_command = '''CREATE TABLE IF NOT EXISTS instances (name TEXT NOT NULL PRIMARY KEY);'''
@@ -46,9 +47,15 @@ instances = [i for dat in data if (i := parse_instance(dat)) is not None]
 
 con = psycopg2.connect(f"dbname=debirdify user={db_user} host=localhost password={db_password}")
 #con.execute(create_command)
+# the display columns are added (once) before the refresh transaction starts
+instance_display.ensure_display_columns(con)
 with con.cursor() as cur:
     cur.executemany('INSERT INTO instances (name, local_domain, software, software_version, registrations_open, users, active_month, active_halfyear, local_posts, last_update, dead, up) VALUES (%s, %s, %s, %s, CAST(%s AS INTEGER), %s, %s, %s, %s, %s, 0, 1) ON CONFLICT(name) DO UPDATE SET name = excluded.name, local_domain = excluded.local_domain, software = excluded.software, software_version = excluded.software_version, registrations_open = excluded.registrations_open, users = excluded.users, active_month = excluded.active_month, active_halfyear = excluded.active_halfyear, local_posts = excluded.local_posts, last_update = excluded.last_update, dead = 0, up = 1',
       instances)
+    # precompute what the web app displays about every instance
+    instance_display.materialize_display_fields(con)
+    # tell the web workers to drop their cached instances (see main/instance.py)
+    cur.execute('NOTIFY instances_changed')
 con.commit()
 con.close()
 
@@ -2,7 +2,7 @@ import traceback
 import os
 import json
 import sqlite3
-import requests
+from main import http_client
 from concurrent.futures import ThreadPoolExecutor
 import time
 import sys
@@ -23,17 +23,6 @@ def env(s):
        print('Missing environment variable: ', s)
    return os.environ[s]
    
-db_file = env(env_db_file)
-
-con = sqlite3.connect(db_file)
-cur = con.cursor()
-cur.execute("SELECT name FROM instances WHERE last_update is NULL OR last_update <= DATE('now', '-1 day') ORDER BY RANDOM() LIMIT ?", (instance_limit,))
-#cur.execute("SELECT name FROM instances WHERE software is NULL")
-#cur.execute("SELECT name FROM instances")
-
-hosts = cur.fetchall()
-cur.close()
-
 max_nodeinfo_tries = 5
 
 def mk_int(x):
@@ -76,7 +65,7 @@ def test_host(row):
     data = None
     error = None
     try:
-        response = requests.get(url=f'https://{name}/.well-known/nodeinfo', headers = {'Accept': 'application/json'}, timeout=timeout, allow_redirects=True)
+        response = http_client.get(f'https://{name}/.well-known/nodeinfo', headers = {'Accept': 'application/json'}, kind='nodeinfo')
         nodeinfo_tries = 1
         links = response.json().get('links') or []
         for link in links:
@@ -86,7 +75,7 @@ def test_host(row):
             if 'href' not in link: continue
             nodeinfo_tries += 1
             try:
-                response = requests.get(url=link['href'], headers = {'Accept': 'application/json'}, timeout=timeout, allow_redirects=True)
+                response = http_client.get(link['href'], headers = {'Accept': 'application/json'}, kind='nodeinfo')
                 json = response.json()
                 if 'activitypub' in json['protocols']:
                     data = parse_json(name, json)
@@ -107,33 +96,47 @@ def dowork(n, callback):
         result = callback(lambda: ())
     return result
 
-results = list()
-new_hosts = list()
-bad_hosts = list()
-errors = dict()
-
-with ThreadPoolExecutor(max_workers = max_workers) as executor:
-    n_hosts = len(hosts)
-    def callback(bar):
-        for name, data, error in executor.map(test_host, hosts, timeout=overall_timeout):
-            bar()
-            if data is None:
-                bad_hosts.append(name)
-                errors[name] = error
-            else:
-                results.append(data)
-    dowork(n_hosts, callback)
-
-
-con.executemany("UPDATE instances SET dead=1, up=0, last_update=CURRENT_TIMESTAMP, error=? WHERE name=?", [(str(err), name) for name, err in errors.items()])
-
 def mk_row(d):
     return (d['software'], d['software_version'], d['registrations_open'], d['users'], d['active_month'], d['active_halfyear'], d['local_posts'], d['name'])
 
-rows = [mk_row(d) for d in results]
-con.executemany("UPDATE instances SET software=?, software_version=?, registrations_open=?, users=?, active_month=?, active_halfyear=?, local_posts=?, up=1, dead=0, last_update=CURRENT_TIMESTAMP WHERE name=?", rows)
-con.commit()
-con.close()
-
-
-
+def main():
+    # upper bound for the timeouts; hosts that answer quickly get shorter ones (see http_client.HostHealth)
+    http_client.timeouts['nodeinfo'] = (timeout, timeout)
+    db_file = env(env_db_file)
+
+    con = sqlite3.connect(db_file)
+    cur = con.cursor()
+    cur.execute("SELECT name FROM instances WHERE last_update is NULL OR last_update <= DATE('now', '-1 day') ORDER BY RANDOM() LIMIT ?", (instance_limit,))
+    #cur.execute("SELECT name FROM instances WHERE software is NULL")
+    #cur.execute("SELECT name FROM instances")
+
+    hosts = cur.fetchall()
+    cur.close()
+
+    results = list()
+    new_hosts = list()
+    bad_hosts = list()
+    errors = dict()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        n_hosts = len(hosts)
+        def callback(bar):
+            for name, data, error in executor.map(test_host, hosts, timeout=overall_timeout):
+                bar()
+                if data is None:
+                    bad_hosts.append(name)
+                    errors[name] = error
+                else:
+                    results.append(data)
+        dowork(n_hosts, callback)
+
+
+    con.executemany("UPDATE instances SET dead=1, up=0, last_update=CURRENT_TIMESTAMP, error=? WHERE name=?", [(str(err), name) for name, err in errors.items()])
+
+    rows = [mk_row(d) for d in results]
+    con.executemany("UPDATE instances SET software=?, software_version=?, registrations_open=?, users=?, active_month=?, active_halfyear=?, local_posts=?, up=1, dead=0, last_update=CURRENT_TIMESTAMP WHERE name=?", rows)
+    con.commit()
+    con.close()
+
+if __name__ == '__main__':
+    main()
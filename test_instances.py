@@ -1,13 +1,13 @@
 import os
 import json
-import sqlite3
-import requests
+import psycopg2
+from main import http_client
 from concurrent.futures import ThreadPoolExecutor
 import time
 import sys
 from alive_progress import alive_bar
 
-env_db_file = 'DEBIRDIFY_INSTANCE_DB'
+db_user = 'debirdify'
 
 max_failures = 3
 timeout = 10
@@ -22,27 +22,19 @@ def env(s):
        print('Missing environment variable: ', s)
    return os.environ[s]
    
-db_file = env(env_db_file)
-
-con = sqlite3.connect(db_file)
-cur = con.cursor()
-cur.execute('SELECT name, failures FROM unknown_hosts')
-hosts = cur.fetchall()
-cur.close()
-
 max_nodeinfo_tries = 3
 
 def test_host(row):
     name, failures = row
     status = 'notsupported'
     try:
-        response = requests.get(url=f'https://{name}/.well-known/nodeinfo', headers = {'Accept': 'application/json'}, timeout=timeout, allow_redirects=True)
+        response = http_client.get(f'https://{name}/.well-known/nodeinfo', headers = {'Accept': 'application/json'}, kind='nodeinfo')
         nodeinfo_tries = 1
         for link in response.json()['links']:
             if nodeinfo_tries > max_nodeinfo_tries: break
             if 'href' not in link: continue
             nodeinfo_tries += 1
-            response = requests.get(url=link['href'], headers = {'Accept': 'application/json'}, timeout=timeout, allow_redirects=True)
+            response = http_client.get(link['href'], headers = {'Accept': 'application/json'}, kind='nodeinfo')
             data = response.json()
             if 'activitypub' in data['protocols']:
                 status = 'supported'
@@ -59,37 +51,56 @@ def dowork(n, callback):
         result = callback(lambda: ())
     return result
 
-new_hosts = list()
-new_bad_hosts = list()
-with ThreadPoolExecutor(max_workers = max_workers) as executor:
-    n_hosts = len(hosts)
-    def callback(bar):
-        for name, failures, status in executor.map(test_host, hosts, timeout=overall_timeout):
-            bar()
-            if status == 'supported':
-                new_hosts.append(name)
-                con.execute('INSERT INTO instances (name) VALUES (?) ON CONFLICT DO NOTHING', (name,))
-                con.execute('DELETE FROM unknown_hosts WHERE name=?', (name,))
-                con.execute('DELETE FROM bad_hosts WHERE name=?', (name,))
-            elif failures >= max_failures:
-                new_bad_hosts.append(name)
-                con.execute('INSERT INTO bad_hosts (name) VALUES (?) ON CONFLICT DO NOTHING', (name,))
-                con.execute('DELETE FROM unknown_hosts WHERE name=?', (name,))
-            else:
-                con.execute('UPDATE unknown_hosts SET failures = failures + 1 WHERE name=?', (name,))
-    dowork(n_hosts, callback)
-    
-con.commit()
-con.close()
+def main():
+    # upper bound for the timeouts; hosts that answer quickly get shorter ones (see http_client.HostHealth)
+    http_client.timeouts['nodeinfo'] = (timeout, timeout)
+    db_password = env('DEBIRDIFY_INSTANCE_DB_PASSWORD')
+
+    # the same database as the web app, which records the unknown hosts and blocks the bad ones
+    con = psycopg2.connect(f"dbname=debirdify user={db_user} host=localhost password={db_password}")
+    cur = con.cursor()
+    cur.execute('CREATE TABLE IF NOT EXISTS unknown_hosts (name TEXT NOT NULL PRIMARY KEY)')
+    cur.execute('ALTER TABLE unknown_hosts ADD COLUMN IF NOT EXISTS failures INTEGER NOT NULL DEFAULT 0')
+    cur.execute('CREATE TABLE IF NOT EXISTS bad_hosts (name TEXT NOT NULL PRIMARY KEY)')
+    cur.execute('SELECT name, failures FROM unknown_hosts')
+    hosts = cur.fetchall()
+
+    new_hosts = list()
+    new_bad_hosts = list()
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        n_hosts = len(hosts)
+        def callback(bar):
+            for name, failures, status in executor.map(test_host, hosts, timeout=overall_timeout):
+                bar()
+                if status == 'supported':
+                    new_hosts.append(name)
+                    cur.execute('INSERT INTO instances (name) VALUES (%s) ON CONFLICT DO NOTHING', (name,))
+                    cur.execute('DELETE FROM unknown_hosts WHERE name=%s', (name,))
+                    cur.execute('DELETE FROM bad_hosts WHERE name=%s', (name,))
+                elif failures >= max_failures:
+                    new_bad_hosts.append(name)
+                    cur.execute('INSERT INTO bad_hosts (name) VALUES (%s) ON CONFLICT DO NOTHING', (name,))
+                    cur.execute('DELETE FROM unknown_hosts WHERE name=%s', (name,))
+                else:
+                    cur.execute('UPDATE unknown_hosts SET failures = failures + 1 WHERE name=%s', (name,))
+        dowork(n_hosts, callback)
 
-if new_hosts:
-    print('New hosts discovered:')
-    for host in new_hosts: print(host)
-    print('')
+    if new_hosts:
+        # tell the web workers to drop their cached instances (see main/instance.py)
+        cur.execute('NOTIFY instances_changed')
+    cur.close()
+    con.commit()
+    con.close()
 
-if new_bad_hosts:
-    print('New bad hosts discovered:')
-    for host in new_bad_hosts: print(host)
-    print('')
+    if new_hosts:
+        print('New hosts discovered:')
+        for host in new_hosts: print(host)
+        print('')
 
+    if new_bad_hosts:
+        print('New bad hosts discovered:')
+        for host in new_bad_hosts: print(host)
+        print('')
 
+if __name__ == '__main__':
+    main()